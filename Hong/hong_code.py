@@ -1,5 +1,6 @@
 # Christopher Hong 
-import math, sys, pygame, time
+import math, os, sys, pygame, time
+import numpy
 from pygame.locals import *
 from datetime import datetime 
 
@@ -24,6 +25,59 @@ def magneticfield(x0,y0,z0,x1,y1,z1,Mx,My,Mz,Px,Py,Pz):
 	# (Px,Py,Pz) is the coordinate for the point in which we are finding the B-field for
 	return dBx,dBy,dBz 
 
+# Calculating Magnetic Field at many points at once, same as magneticfield() summed over all segments
+def magneticfield_array(P,start,end,chunk=64):
+	# P is an (n,3) array of points, start/end are (m,3) arrays of the segment endpoints
+	# Points are done chunk at a time so the (chunk,m,3) temporaries stay small
+	dl=end-start
+	M=(start+end)/2
+	dlxM=numpy.cross(dl,M)
+	dB=numpy.zeros(P.shape)
+	for i in range(0,len(P),chunk):
+		Pc=P[i:i+chunk]
+		d=Pc[:,None,:]-M[None,:,:]
+		r=numpy.sqrt((d**2).sum(axis=2)) 				# Distance from each wire segment to each point
+		factor=k*current*r**(-3)
+		# sum of factor*(dl x (P-M)) = (sum factor*dl) x P - sum factor*(dl x M)
+		dB[i:i+chunk]=numpy.cross(factor.dot(dl),Pc)-factor.dot(dlxM)
+	return dB
+
+# Headless mode: vectorized B-field over the grid, drawn off-screen and saved to a PNG
+def headless(circle,fine=1,out='hong_code.png',theta=None,kernel='midpoint'):
+	# fine makes the grid of points fine times denser in each direction (fine=1 is the usual 357 points)
+	# theta sums the B-field with Leong's octree using this opening angle, instead of segment by segment
+	# kernel='exact' uses the exact field of each straight segment (Leong's segments.py), not the midpoint one
+	c=numpy.array(circle,dtype=float)[:,1:]
+	Pi=numpy.arange(int(-2*W/25-13),int(2*W/25),int(H20+5)/float(fine))
+	Pj=numpy.arange(int(-H2),int(H2+1),int(H20)/float(fine))
+	P=numpy.zeros((len(Pi)*len(Pj),3))
+	P[:,0]=numpy.repeat(Pi,len(Pj))
+	P[:,1]=numpy.tile(Pj,len(Pi))
+	
+	if theta or kernel!='midpoint':
+		sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','Leong'))
+		import octree, segments
+		segs=segments.Segments(c[:-1],c[1:],current,k,kernel)
+		dBtotal=(octree.Tree(segs,theta) if theta else segs).field(P)
+	else:
+		dBtotal=magneticfield_array(P,c[:-1],c[1:])
+	magB=numpy.sqrt((dBtotal**2).sum(axis=1))
+	colorscale=190/(magB.max()-magB.min())
+	
+	# Draw everything on a surface that never goes to the screen
+	screen=pygame.Surface((W,H))
+	for i in range(num_of_points): 
+		pygame.draw.aaline(screen,(75,75,75),(mult*c[i][0]+W2,-mult*c[i][1]+H2),(mult*c[i+1][0]+W2,-mult*c[i+1][1]+H2),2)
+	u=2.5*dBtotal[:,:2]/magB[:,None]
+	a=mult*(P[:,:2]-u)
+	b=mult*(P[:,:2]+u)
+	for Pi in range(len(P)):
+		color=magB[Pi]*colorscale
+		pygame.draw.aaline(screen,(0,color+55,0),(a[Pi][0]+W2,-a[Pi][1]+H2),(b[Pi][0]+W2,-b[Pi][1]+H2),10)
+		pygame.draw.aaline(screen,(0,color+55,0),(a[Pi][0]+W2,-a[Pi][1]+H2-1),(b[Pi][0]+W2,-b[Pi][1]+H2-1),10)
+	pygame.image.save(screen,out)
+	return P,dBtotal
+
 #-------------------------------------------------------------------------------------------#
 	
 # MAIN 
@@ -69,6 +123,26 @@ W,H=500,500							# Size of window
 W2,H2=W/2,H/2
 W20,H20=W/50,H/50 						# Adjust factor to increase/decrease # of points to calculate B-field
 numofrows=357 #int(((H20)+1)*(7)) 
+
+# python hong_code.py --headless [fine] [out.png] [--theta 0.5] [--exact] runs without a display
+if '--headless' in sys.argv:
+	args=[]
+	theta=None
+	kernel='midpoint'
+	rest=sys.argv[sys.argv.index('--headless')+1:]
+	while rest:
+		a=rest.pop(0)
+		if a=='--theta':
+			theta=float(rest.pop(0))
+		elif a=='--exact':
+			kernel='exact'
+		else:
+			args.append(a)
+	fine=int(args[0]) if len(args)>0 else 1
+	out=args[1] if len(args)>1 else 'hong_code.png'
+	headless(circle,fine,out,theta,kernel)
+	sys.exit()
+
 pygame.init() 							# Initiates pygame
 screen=pygame.display.set_mode((W,H)) 	                        # Sets the window up 
 pygame.display.set_caption('Magnetic Fields')                   # Caption
@@ -0,0 +1,167 @@
+'''
+Benchmarks the field, tracing and frame pipeline of B-calculate.py
+on the fixed scenes in scenes.py.
+
+For each scene it times
+    bfield     - the field at the scene's probe points
+    fieldline  - tracing every field line of the frame
+    calculate  - a whole frame, wires and field lines
+    animate    - one frame through animate(), including the file
+and reports the throughput and peak memory of each.
+
+    python B-benchmark.py [-o results.json] [--compare old.json]
+                          [--scenes single,toroid] [--repeat 3]
+
+Results are saved as JSON (with the git commit they were run on),
+so runs on different commits can be compared with --compare.
+'''
+
+import argparse
+import imp
+import json
+import numpy
+import os
+import platform
+import resource
+import scenes
+import shutil
+import subprocess
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+calc = imp.load_source('B_calculate', os.path.join(here, 'B-calculate.py'))
+
+def reset_peak():
+    '''Resets the peak memory of this process, where Linux allows it.'''
+    try:
+        f = open('/proc/self/clear_refs', 'w')
+        f.write('5')
+        f.close()
+        return True
+    except IOError:
+        return False
+
+def peak_memory():
+    '''Peak resident memory of this process in MB.'''
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024.
+    except IOError:
+        pass
+    # ru_maxrss is in kB on Linux; it can't be reset.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def measure(f, repeat):
+    '''Best time of f() over repeat runs, the peak memory and f's result.'''
+    best = None
+    peak = 0
+    for i in range(repeat):
+        reset_peak()
+        stime = time.time()
+        result = f()
+        elapsed = time.time() - stime
+        peak = max(peak, peak_memory())
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, peak, result
+
+def bench_scene(name, repeat):
+    '''Runs all benchmarks on one scene.  Returns a list of records.'''
+    wires = scenes.SCENES[name]()
+    at = 0
+    records = []
+
+    # Build the frame once, to get the segments and seeds.
+    starts = []
+    w = [calc.split(*wire, starts=starts, at=at) for wire in wires]
+    segs = calc.pack(w, calc.I, calc.k)
+    probes = scenes.probes(name)
+
+    # bfield: the field at all the probe points, one at a time and together
+    t, peak, b = measure(lambda: [calc.bfield(p[0], p[1], p[2], segs) for p in probes], repeat)
+    records.append({'scene': name, 'bench': 'bfield', 'seconds': t, 'peak_mb': peak,
+                    'evals_per_s': len(probes) / t,
+                    'pairs_per_s': len(probes) * len(segs) / t})
+    t, peak, b = measure(lambda: segs.field(probes), repeat)
+    records.append({'scene': name, 'bench': 'bfield_batch', 'seconds': t, 'peak_mb': peak,
+                    'evals_per_s': len(probes) / t,
+                    'pairs_per_s': len(probes) * len(segs) / t})
+
+    # fieldline: every field line of the frame
+    stats = {}
+    t, peak, lines = measure(lambda: calc.fieldlines(starts, segs, stats=stats), repeat)
+    steps = sum(len(line) - 1 for line in lines)
+    records.append({'scene': name, 'bench': 'fieldline', 'seconds': t, 'peak_mb': peak,
+                    'lines': len(lines), 'steps': steps, 'steps_per_s': steps / t,
+                    'evals': int(stats['evals'].sum()),
+                    'evals_per_s': stats['evals'].sum() / t})
+
+    # calculate: a whole frame, without any cached geometry
+    t, peak, frame = measure(lambda: calc.calculate(wires, at), repeat)
+    records.append({'scene': name, 'bench': 'calculate', 'seconds': t, 'peak_mb': peak,
+                    'frames_per_min': 60 / t})
+
+    # animate: one frame, written to a scratch folder
+    folder = tempfile.mkdtemp()
+    try:
+        prepend = os.path.join(folder, 'line_')
+        t, peak, r = measure(lambda: calc.animate(wires, at, at + .5, 1, prepend), repeat)
+        records.append({'scene': name, 'bench': 'animate', 'seconds': t, 'peak_mb': peak,
+                        'frames_per_min': 60 / t})
+    finally:
+        shutil.rmtree(folder)
+
+    return records
+
+def commit():
+    '''Git commit of the code being measured, if there is one.'''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=here, stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def show(records, old=None):
+    '''Prints the records, with the change from old ones if given.'''
+    before = {}
+    for r in old or []:
+        before[r['scene'], r['bench']] = r
+
+    print '%-9s %-13s %10s %9s  %s' % ('scene', 'bench', 'seconds', 'peak MB', 'throughput')
+    for r in records:
+        rate = ', '.join('%s %.4g' % (key, r[key]) for key in sorted(r)
+                         if key.endswith('_per_s') or key.endswith('_per_min'))
+        line = '%-9s %-13s %10.4f %9.1f  %s' % (r['scene'], r['bench'], r['seconds'], r['peak_mb'], rate)
+        o = before.get((r['scene'], r['bench']))
+        if o:
+            line += '  (x%.2f speed vs old)' % (o['seconds'] / r['seconds'])
+        print line
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark B-calculate.py on reference scenes.')
+    parser.add_argument('-o', '--output', help='save results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--scenes', default='single,toroid,solenoid', help='comma separated scenes')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark (best is kept)')
+    args = parser.parse_args()
+
+    records = []
+    for name in args.scenes.split(','):
+        records += bench_scene(name, args.repeat)
+
+    old = None
+    if args.compare:
+        old = json.load(open(args.compare))['records']
+    show(records, old)
+
+    if args.output:
+        f = open(args.output, 'w')
+        json.dump({'commit': commit(),
+                   'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'python': platform.python_version(),
+                   'numpy': numpy.__version__,
+                   'machine': platform.machine(),
+                   'records': records}, f, indent=1, sort_keys=True)
+        f.close()
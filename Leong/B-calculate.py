@@ -8,10 +8,20 @@ Created on Dec 4, 2011
 with guidance from Professor Wolf
 '''
 
-from numpy.ma.core import sqrt
+from math import sqrt
+from segments import pack
+import fieldgrid
+import octree
+import frames
+import hashlib
 import inspect
+import json
 import math
-import pickle
+import multiprocessing
+import numpy
+import os
+import segments
+import shutil
 import time
 
 # constants
@@ -44,22 +54,15 @@ def bfield_segment(x, y, z, lx0, ly0, lz0, lx1, ly1, lz1):
     return dbx, dby, dbz
 
 def bfield(x, y, z, w):
-    '''Calculates the b field at the given point from the wires.'''
-    
-    # Initial b field
-    bx, by, bz = 0, 0, 0
-    
-    for wire in w:
-        # Iterate using an index in order to access the next element
-        for p in range(len(wire) - 1):
-            dbx, dby, dbz = bfield_segment(x, y, z,
-                                wire[p][0], wire[p][1], wire[p][2],
-                                wire[p + 1][0], wire[p + 1][1], wire[p + 1][2])
-            
-            bx += dbx
-            by += dby
-            bz += dbz
-                    
+    '''Calculates the b field at the given point from the wires.
+    w is either a list of wires, the Segments from pack()
+    or anything else with the same field(), like an octree.Tree.
+    '''
+    # Pack the wires if they haven't been already.
+    if not hasattr(w, 'field'):
+        w = pack(w, I, k)
+
+    bx, by, bz = w.field((x, y, z))[0]
     return bx, by, bz
 
 def bfield_mag(x, y, z, w):
@@ -67,90 +70,379 @@ def bfield_mag(x, y, z, w):
     bx, by, bz = bfield(x, y, z, w)
     return sqrt(bx ** 2 + by ** 2 + bz ** 2)
 
-def fieldpoint(i, t, h, d, w):
-    '''Calculates a point in the field line.
-    Note that there is no time dependence.
+def fieldpoint(p, w):
+    '''Calculates the field direction at each of the points p.
+    Returns the unit vectors along b and the magnitude of b.
     '''
-    # Determine the next position.
-    o = map(lambda i, d: [i[0] + d[0] * h, i[1] + d[1] * h], i, d)
-    
-    # Determine the magnetic field at the new position.
-    bx, by, bz = bfield(o[0][0], o[1][0], o[2][0], w)
-    b = sqrt(bx ** 2 + by ** 2 + bz ** 2)
+    b = w.field(p)
+    mag = numpy.sqrt((b ** 2).sum(axis=1))
     
     # Avoid divide by zero errors
-    if b == 0:
-        # It's probably [[0, 0], [0, 0], [0, 0]]
-        # But due to floating point error, it might not actually be.
-        return [[bx, 0], [by, 0], [bz, 0]]
+    # Where b is 0 (or close to it), leave the field as is.
+    nz = mag != 0
     
     # Divide by magnetic field strength to arrive at the gradient.
-    return [[bx / b, 0], [by / b, 0], [bz / b, 0]]
+    b[nz] /= mag[nz, None]
+    return b, mag
 
-def integrate(o, t, h, w):
-    '''Calculates the next position given initial position o.
+def integrate(p, k1, h, w):
+    '''Calculates the next positions given initial positions p.
     Uses a forth order Runge-Kutta implementation.
-    Note that o is this format: [[x, vx], [y, vy], [z, vz]]
-    Also note that there is no time dependence, so t and h don't depend on anything.
+    Note that p has one row per field line, and k1 is the
+    gradient at p (from fieldpoint), which the caller already has.
+    Returns the new positions, and the gradient and magnitude there.
     '''
-    k1 = fieldpoint(o, t, 0, [[0, 0]] * len(o), w)
-    k2 = fieldpoint(o, t + h / 2., h / 2., k1, w)
-    k3 = fieldpoint(o, t + h / 2., h / 2., k2, w)
-    k4 = fieldpoint(o, t + h, h, k3, w)
+    k2 = fieldpoint(p + k1 * (h / 2.), w)[0]
+    k3 = fieldpoint(p + k2 * (h / 2.), w)[0]
+    k4 = fieldpoint(p + k3 * h, w)[0]
     
-    # Return it back into this form [[x, vx], [y, vy], [z, vz]]
-    return map(lambda o, k1, k2, k3, k4: 
-               [o[0] + 1 / 6. * h * (k1[0] + 2 * k2[0] + 2 * k3[0] + k4[0]),
-                o[1] + 1 / 6. * h * (k1[1] + 2 * k2[1] + 2 * k3[1] + k4[1])],
-               o, k1, k2, k3, k4)
-
-def fieldline(x, y, z, w, sstart=0, send=100, sstep=.5):
-    '''Creates one field line.'''
-    # Store magnitude of b
-    b = bfield_mag(x, y, z, w)
+    o = p + 1 / 6. * h * (k1 + 2 * k2 + 2 * k3 + k4)
+    
+    # The gradient at the new position is the next step's k1,
+    # and its magnitude is stored with the point.
+    k, b = fieldpoint(o, w)
+    return o, k, b
 
+def fieldlines(starts, w, sstart=0, send=100, sstep=.5, stats=None, stop=None,
+               backward=False):
+    '''Creates the field lines for all the start points at once.
+    Every line that is still going is advanced by the same step,
+    so each field evaluation covers all of them.
+    stats - if given, a dict that gets the number of field
+            evaluations used by each line under 'evals', and
+            whether each line closed on itself under 'closed'
+    stop - if given, called with the new positions and the indices of
+           their lines after each step, returning which lines to end
+           before them (see SpatialHash.hit)
+    backward - trace against the field instead of along it
+    '''
+    # Pack the wires if they haven't been already.
+    if not hasattr(w, 'field'):
+        w = pack(w, I, k)
+    
+    seeds = numpy.array(starts, dtype=float).reshape(-1, 3)
+    
     # Initial position + strength of field line.
-    line = [[x, y, z, b]]
+    pos = seeds.copy()
+    grad, b = fieldpoint(pos, w)
+    lines = [[list(p) + [m]] for p, m in zip(pos.tolist(), b.tolist())]
+    h = -sstep if backward else sstep
+    
+    # Indices of the lines that are still going
+    active = numpy.arange(len(seeds))
+    # Field evaluations per line, and whether it closed early
+    evals = numpy.ones(len(seeds), dtype=int)
+    closed = numpy.zeros(len(seeds), dtype=bool)
     
     s = sstart
-    # Initial position + velocity
-    pos = [[x, 0], [y, 0], [z, 0]]
+    while s <= send + sstep and len(active):
+        # Determine next positions.
+        pos, grad, b = integrate(pos, grad, h, w)
+        evals[active] += 4
+        
+        # End the lines that would run into others
+        if stop is not None:
+            done = stop(pos, active)
+            active = active[~done]
+            pos = pos[~done]
+            grad = grad[~done]
+            b = b[~done]
+        
+        # Add points to lines
+        for i, p, m in zip(active, pos.tolist(), b.tolist()):
+            lines[i].append(p + [m])
+        
+        # if near the start point (again), don't go on
+        if s > sstart + sstep:
+            dist_sq = ((seeds[active] - pos) ** 2).sum(axis=1)
+            done = dist_sq < sstep ** 2
+            
+            if done.any():
+                # Integrate once more to 'cover' the hole in case the line hasn't been finished
+                last = integrate(pos[done], grad[done], h, w)
+                evals[active[done]] += 4
+                closed[active[done]] = True
+                for i, p, m in zip(active[done], last[0].tolist(), last[2].tolist()):
+                    lines[i].append(p + [m])
+                
+                # Drop the finished lines
+                active = active[~done]
+                pos = pos[~done]
+                grad = grad[~done]
+        
+        s += sstep
+    
+    if stats is not None:
+        stats['evals'] = evals
+        stats['closed'] = closed
+    return lines
+
+class SpatialHash(object):
+    '''Points of the field lines traced so far, kept in cubic cells
+    of the given size, so the points near any place are quick to find.
+    '''
+    
+    def __init__(self, size):
+        self.size = size
+        # cell -> [(line, point)]
+        self.cells = {}
+    
+    def cell(self, p):
+        return (int(math.floor(p[0] / self.size)), int(math.floor(p[1] / self.size)),
+                int(math.floor(p[2] / self.size)))
+    
+    def add(self, points, ids):
+        '''Adds the points of the lines ids.'''
+        for p, i in zip(points, ids):
+            self.cells.setdefault(self.cell(p), []).append((i, tuple(p)))
+    
+    def near(self, points, ids, dist):
+        '''Which of the points are closer than dist (at most the cell size)
+        to a point of a line other than their own.
+        '''
+        dist_sq = dist ** 2
+        found = numpy.zeros(len(points), dtype=bool)
+        for n, (p, i) in enumerate(zip(points, ids)):
+            cx, cy, cz = self.cell(p)
+            for cell in [(cx + a, cy + b, cz + c) for a in (-1, 0, 1) for b in (-1, 0, 1) for c in (-1, 0, 1)]:
+                for j, q in self.cells.get(cell, ()):
+                    if j != i and (q[0] - p[0]) ** 2 + (q[1] - p[1]) ** 2 + (q[2] - p[2]) ** 2 < dist_sq:
+                        found[n] = True
+                        break
+                if found[n]:
+                    break
+        return found
+    
+    def hit(self, points, ids, dist):
+        '''Like near(), then adds the points that aren't.'''
+        points = numpy.asarray(points).tolist()
+        found = self.near(points, ids, dist)
+        self.add([p for p, f in zip(points, found) if not f],
+                 [i for i, f in zip(ids, found) if not f])
+        return found
+
+def candidates(lines, sep, sstep=.5):
+    '''Possible new start points, sep to either side of the lines
+    in two directions across them, about every sep along them.
+    '''
+    every = max(1, int(sep / sstep))
+    seeds = []
+    for line in lines:
+        p = numpy.array(line, dtype=float).reshape(-1, 4)[:, :3]
+        if len(p) < 2:
+            continue
+        # Direction along the line at each point
+        t = p[numpy.minimum(numpy.arange(len(p)) + 1, len(p) - 1)] - p[numpy.maximum(numpy.arange(len(p)) - 1, 0)]
+        t = t[::every]
+        p = p[::every]
+        # Two directions across it
+        axis = numpy.identity(3)[numpy.abs(t).argmin(axis=1)]
+        u = numpy.cross(t, axis)
+        v = numpy.cross(t, u)
+        for d in (u, v):
+            length = numpy.sqrt((d ** 2).sum(axis=1))
+            ok = length > 0
+            d = d[ok] / length[ok, None] * sep
+            seeds.extend((p[ok] + d).tolist())
+            seeds.extend((p[ok] - d).tolist())
+    return seeds
+
+def fieldlines_even(starts, w, sep, test=.5, maxlines=1000, bounds=None,
+                    sstart=0, send=100, sstep=.5, stats=None):
+    '''Creates field lines about sep apart (after Jobard and Lefer).
+    The start points are used first, except any closer than sep to
+    one already taken.  Each line is traced both ways from its start,
+    and ends before it comes within test * sep of another line.  New
+    lines start beside the traced ones wherever there's room, until
+    there's none left or there are maxlines lines.
+    bounds - (lo, hi) corners of the box new lines can start in
+    stats - as for fieldlines()
+    '''
+    if not hasattr(w, 'field'):
+        w = pack(w, I, k)
     
-    while s <= send + sstep:
-        # Determine next position.
-        pos = integrate(pos, s, sstep, w)
+    grid = SpatialHash(sep)
+    lines = []
+    evals = []
+    closed = []
+    todo = numpy.array(starts, dtype=float).reshape(-1, 3).tolist()
+    while todo and len(lines) < maxlines:
+        # Take the start points that are clear of the lines so far.
+        batch = []
+        for p in todo:
+            if len(lines) + len(batch) >= maxlines:
+                break
+            i = len(lines) + len(batch)
+            if not grid.near([p], [i], sep)[0]:
+                grid.add([p], [i])
+                batch.append(p)
+        if not batch:
+            break
         
-        # Remove velocity from position
-        pos = [[pos[0][0], 0], [pos[1][0], 0], [pos[2][0], 0]]
+        # Trace them together along the field, each stopping at the
+        # lines so far, then back from the ones that didn't close.
+        # Both halves of a line go in the hash under its index.
+        base = len(lines)
+        ahead = {}
+        traced = fieldlines(batch, w, sstart, send, sstep, ahead,
+                            lambda p, idx: grid.hit(p, idx + base, test * sep))
+        back = numpy.flatnonzero(~ahead['closed'])
+        behind = {}
+        rest = fieldlines([batch[j] for j in back], w, sstart, send, sstep, behind,
+                          lambda p, idx: grid.hit(p, back[idx] + base, test * sep), backward=True)
+        
+        # The hash only has the points the stop test saw, not the
+        # extra point of a line that closed.
+        for j, line in enumerate(traced):
+            if ahead['closed'][j]:
+                grid.add([line[-1][:3]], [base + j])
+        for n, j in enumerate(back):
+            if behind['closed'][n]:
+                grid.add([rest[n][-1][:3]], [base + j])
+            traced[j] = rest[n][:0:-1] + traced[j]
+        ahead['evals'][back] += behind['evals'] - 1
+        ahead['closed'][back] |= behind['closed']
+        
+        lines += traced
+        evals.append(ahead['evals'])
+        closed.append(ahead['closed'])
+        
+        todo = candidates(traced, sep, sstep)
+        if bounds is not None:
+            todo = [p for p in todo if (numpy.greater_equal(p, bounds[0]) & numpy.less_equal(p, bounds[1])).all()]
+    
+    if stats is not None:
+        stats['evals'] = numpy.concatenate(evals) if evals else numpy.zeros(0, dtype=int)
+        stats['closed'] = numpy.concatenate(closed) if closed else numpy.zeros(0, dtype=bool)
+    return lines
+
+# Dormand-Prince 5(4) coefficients.
+# Each row is a stage: the node c and the weights a of the earlier stages.
+# The last stage is at the new position, so it doubles as the next k1.
+DOPRI_A = [
+    (1 / 5., [1 / 5.]),
+    (3 / 10., [3 / 40., 9 / 40.]),
+    (4 / 5., [44 / 45., -56 / 15., 32 / 9.]),
+    (8 / 9., [19372 / 6561., -25360 / 2187., 64448 / 6561., -212 / 729.]),
+    (1., [9017 / 3168., -355 / 33., 46732 / 5247., 49 / 176., -5103 / 18656.]),
+    (1., [35 / 384., 0, 500 / 1113., 125 / 192., -2187 / 6784., 11 / 84.]),
+    ]
+# Fifth order minus fourth order weights, for the error estimate
+DOPRI_E = [71 / 57600., 0, -71 / 16695., 71 / 1920., -17253 / 339200., 22 / 525., -1 / 40.]
 
-        # Store magnitude of b field
-        b = bfield_mag(pos[0][0], pos[1][0], pos[2][0], w)
+def integrate_adaptive(p, k1, h, w):
+    '''Takes one Dormand-Prince step of size h (one per row of p).
+    Returns the new positions, the gradient and magnitude there,
+    and the estimated error of each step.
+    '''
+    h = h[:, None]
+    k = [k1]
+    for c, a in DOPRI_A:
+        o = p + h * sum(ai * ki for ai, ki in zip(a, k) if ai)
+        grad, b = fieldpoint(o, w)
+        k.append(grad)
+    
+    err = h * sum(ei * ki for ei, ki in zip(DOPRI_E, k) if ei)
+    return o, grad, b, numpy.sqrt((err ** 2).sum(axis=1))
 
-        # Add point to line
-        line.append([pos[0][0], pos[1][0], pos[2][0], b])
+def fieldlines_adaptive(starts, w, sstart=0, send=100, sstep=.5, tol=1e-4,
+                        hmax=1., stats=None):
+    '''Creates the field lines for all the start points at once,
+    with an adaptive step size for each line.
+    sstep - the first step (and the closing distance) for every line
+    tol - allowed position error per step
+    hmax - the largest step, so lines stay smooth when drawn
+    stats - if given, a dict that gets the number of field
+            evaluations used by each line under 'evals', and
+            whether each line closed on itself under 'closed'
+    '''
+    # Pack the wires if they haven't been already.
+    if not hasattr(w, 'field'):
+        w = pack(w, I, k)
+    
+    seeds = numpy.array(starts, dtype=float).reshape(-1, 3)
+    n = len(seeds)
+    
+    # Initial position + strength of field line.
+    pos = seeds.copy()
+    grad, b = fieldpoint(pos, w)
+    lines = [[list(p) + [m]] for p, m in zip(pos.tolist(), b.tolist())]
+    evals = numpy.ones(n, dtype=int)
+    closed = numpy.zeros(n, dtype=bool)
+    
+    # State of the lines that are still going
+    active = numpy.arange(n)
+    h = numpy.empty(n)
+    h.fill(sstep)
+    s = numpy.empty(n)
+    s.fill(sstart)
+    closing = numpy.zeros(n, dtype=bool)
+    
+    while len(active):
+        o, ograd, ob, err = integrate_adaptive(pos, grad, h, w)
+        evals[active] += 6
         
-        # if near the start point (again), don't go on
-        dist_sq = (x - pos[0][0]) ** 2 + (y - pos[1][0]) ** 2 + (z - pos[2][0]) ** 2
-        if s > sstart + sstep and dist_sq < sstep ** 2:
-            # Integrate once more to 'cover' the hole in case the line hasn't been finished
-            pos = integrate(pos, s, sstep, w)
-            # Remove velocity from position
-            pos = [[pos[0][0], 0], [pos[1][0], 0], [pos[2][0], 0]]
-            # Store magntitude of b field
-            b = bfield_mag(pos[0][0], pos[1][0], pos[2][0], w)
-            # Add point to line
-            line.append([pos[0][0], pos[1][0], pos[2][0], b])
-            break
+        # Accept the steps that are within tolerance (or can't get smaller).
+        ok = (err <= tol) | (h <= sstep * 1e-3)
+        for i, p, m in zip(active[ok], o[ok].tolist(), ob[ok].tolist()):
+            lines[i].append(p + [m])
+        pos[ok] = o[ok]
+        grad[ok] = ograd[ok]
+        s[ok] += h[ok]
         
-        s += sstep
+        # Lines that were closing have now covered the hole.
+        done = ok & closing
+        closed[active[done]] = True
+        
+        # if near the start point (again), go one step more and stop.
+        # The step just taken sets the distance, as it can be much
+        # longer than sstep.
+        dist = numpy.sqrt(((seeds[active] - pos) ** 2).sum(axis=1))
+        near = ok & (s - sstart > 2 * numpy.maximum(h, sstep)) & (dist < numpy.maximum(h, sstep))
+        closing |= near
+        done |= ok & (s > send)
+        
+        # New step size from the error estimate.
+        scale = 0.9 * (tol / numpy.maximum(err, 1e-300)) ** .2
+        h = numpy.clip(h * numpy.clip(scale, .2, 5.), sstep * 1e-3, hmax)
         
-    return line
+        # Drop the finished lines
+        keep = ~done
+        active = active[keep]
+        pos = pos[keep]
+        grad = grad[keep]
+        h = h[keep]
+        s = s[keep]
+        closing = closing[keep]
+    
+    if stats is not None:
+        stats['evals'] = evals
+        stats['closed'] = closed
+    return lines
+
+def fieldline(x, y, z, w, sstart=0, send=100, sstep=.5):
+    '''Creates one field line.'''
+    return fieldlines([(x, y, z)], w, sstart, send, sstep)[0]
+
+# Number of arguments of each wire function, see argcount()
+argcounts = {}
+
+def argcount(f):
+    '''Number of arguments to f.
+    Remembered, since inspect.getargspec is slow.
+    '''
+    if f not in argcounts:
+        argcounts[f] = len(inspect.getargspec(f)[0])
+    return argcounts[f]
 
-def split(tstart, tend, tstep, f, offsets=[], nlines=5, valid=True, starts=[], at=0):
+def split(tstart, tend, tstep, f, offsets=[], nlines=5, valid=True, symmetry=None,
+          current=None, starts=[], at=0):
     '''Split the wire into segments.
     offsets - the numerical values to offset the the function by.
     nlines - number of field lines for this wire.
     valid - whether or not the wire is active at this time
+    symmetry - copies of the wire, used by calculate(), see transforms()
+    current - the wire's current, used by calculate(), see current()
     starts - exact positions that the magnetic field lines should start at
     '''
     
@@ -166,7 +458,7 @@ def split(tstart, tend, tstep, f, offsets=[], nlines=5, valid=True, starts=[], a
     # Number of segments between field lines
     numbetweenflines = math.ceil((tend - tstart) / (nlines * tstep))
     # Number of arguments to f
-    numargs = len(inspect.getargspec(f)[0])
+    numargs = argcount(f)
 
     n = 0
     t = tstart
@@ -212,40 +504,811 @@ def split(tstart, tend, tstep, f, offsets=[], nlines=5, valid=True, starts=[], a
         
     return points
 
-def calculate(wires, at=0):
-    '''Calculate the wire segments and field line points.'''
+# Axis names for symmetries
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+def transforms(symmetry):
+    '''The copies a wire's symmetry makes, as 3 by 3 matrices.
+    The first is always the identity (the wire itself).
+    symmetry - None for just the wire,
+               ('rotate', n) or ('rotate', n, axis) for n copies evenly
+               spaced around the axis (z by default),
+               ('mirror', axis) for the wire and its mirror image
+               across the plane through the origin normal to the axis.
+    '''
+    if not symmetry:
+        return [numpy.identity(3)]
+    
+    if symmetry[0] == 'rotate':
+        n = symmetry[1]
+        axis = AXES[symmetry[2] if len(symmetry) > 2 else 'z']
+        i, j = [a for a in range(3) if a != axis]
+        mats = [numpy.identity(3)]
+        for m in range(1, n):
+            phi = m * 2 * math.pi / n
+            R = numpy.identity(3)
+            R[i, i] = R[j, j] = math.cos(phi)
+            R[i, j] = -math.sin(phi)
+            R[j, i] = math.sin(phi)
+            mats.append(R)
+        return mats
+    
+    if symmetry[0] == 'mirror':
+        M = numpy.identity(3)
+        M[AXES[symmetry[1]], AXES[symmetry[1]]] = -1
+        return [numpy.identity(3), M]
+    
+    raise ValueError('unknown symmetry %r' % (symmetry,))
+
+def shape(wire):
+    '''Whether the wire is a shape from primitives.py, not a spec list.'''
+    return hasattr(wire, 'build')
+
+def symmetry(wire):
+    '''The symmetry of a wire, as a tuple, or None.'''
+    if shape(wire):
+        sym = wire.symmetry
+    else:
+        sym = wire[7] if len(wire) > 7 else None
+    return tuple(sym) if sym else None
+
+def current(wire, at):
+    '''Current of a wire at time at: the current given in its spec
+    (a number or a function of at), otherwise I.
+    '''
+    if shape(wire):
+        i = wire.current if wire.current is not None else I
+    else:
+        i = wire[8] if len(wire) > 8 and wire[8] is not None else I
+    if hasattr(i, '__call__'):
+        i = i(at)
+    return i
+
+def transform_lines(lines, R):
+    '''Field lines moved by the rotation or reflection R.
+    The magnitude of b is the same at the moved points.
+    '''
+    moved = []
+    for line in lines:
+        line = numpy.array(line, dtype=float).reshape(-1, 4)
+        line[:, :3] = line[:, :3].dot(R.T)
+        moved.append(line.tolist())
+    return moved
+
+def static(wire):
+    '''Whether the wire's geometry can't depend on the animation time.'''
+    if shape(wire):
+        return wire.static()
+    valid = wire[6] if len(wire) > 6 else True
+    return argcount(wire[3]) < 3 and not hasattr(valid, '__call__')
+
+class GeometryCache(object):
+    '''Remembers the wires built by split() from frame to frame.
+    Wires that can't depend on the animation time are only built once.
+    Wires that come out the same as last frame keep their old point
+    arrays, and if no wire changed the packed segments are reused too.
+    A symmetric wire is built once and its copies made by moving
+    the points.
+    frames - about how many frames the cache is used for, so a field
+             grid of wires that can't move can pay for itself over
+             all of them (see calculate())
+    '''
+    
+    def __init__(self, frames=1):
+        # About how many frames the cache is used for
+        self.frames = frames
+        # id(wire spec) -> (wire spec, at, points, starts, point arrays),
+        # with points and arrays for each copy of the wire.
+        # The spec is kept so its id can't be reused.
+        self.wires = {}
+        # Point arrays, currents and segments of the last pack
+        self.arrays = []
+        self.currents = []
+        self.segs = None
+        # Key, point arrays and unit fields of the last units()
+        self.unit = None
+        # About how many field evaluations and calls the last frame's
+        # trace took with grid='auto', some of the points it went
+        # through, and the number of frames traced, to tell whether a
+        # grid pays for itself, see calculate()
+        self.evals = None
+        self.calls = None
+        self.points = None
+        self.traced = 0
+        # Number of wires actually built by split()
+        self.built = 0
+    
+    def build(self, wire, at):
+        '''Builds one wire at time at.
+        Returns the points of each copy of it (see transforms()),
+        its field line start points and the point array of each copy.
+        '''
+        entry = self.wires.get(id(wire))
+        if entry is not None and (entry[1] == at or static(wire)):
+            return entry[2:]
+        
+        if shape(wire):
+            points, starts = wire.build(at)
+            starts = starts.tolist()
+        else:
+            starts = []
+            points = split(*wire[:7], starts=starts, at=at)
+        self.built += 1
+        array = numpy.asarray(points, dtype=float).reshape(-1, 3)
+        
+        if entry is not None and entry[3] == starts and numpy.array_equal(entry[4][0], array):
+            # Keep the old arrays if the wire didn't move.
+            copies, arrays = entry[2], entry[4]
+        else:
+            copies = [points]
+            arrays = [array]
+            for R in transforms(symmetry(wire))[1:]:
+                arrays.append(array.dot(R.T))
+                copies.append(arrays[-1].tolist())
+        
+        self.wires[id(wire)] = (wire, at, copies, starts, arrays)
+        return copies, starts, arrays
+    
+    def pack(self, arrays, kernel='midpoint', currents=I, dtype=numpy.float64):
+        '''Packs the point arrays, with the current (or one for each),
+        reusing the last pack if they're the same.
+        '''
+        if (self.segs is None or self.segs.kernel != kernel or self.segs.dtype != dtype
+                or len(arrays) != len(self.arrays)
+                or any(a is not b for a, b in zip(arrays, self.arrays))
+                or currents != self.currents):
+            self.arrays = arrays
+            self.currents = currents
+            self.segs = pack(arrays, currents, k, kernel, dtype)
+        return self.segs
+    
+    def units(self, arrays, groups, grid, theta=None, kernel='midpoint', dtype=numpy.float64):
+        '''Field of each wire at unit current on a grid (with groups[i]
+        point arrays for wire i, its copies), see fieldgrid.UnitFields.
+        Reused as long as the wires don't move, whatever their currents.
+        '''
+        if not self.has_units(arrays, groups, grid, theta, kernel, dtype):
+            units = []
+            i = 0
+            for n in groups:
+                unit = pack(arrays[i:i + n], 1, k, kernel, dtype)
+                if theta and len(unit):
+                    unit = octree.Tree(unit, theta)
+                units.append(unit)
+                i += n
+            key = (grid, theta, kernel, numpy.dtype(dtype), tuple(groups))
+            self.unit = (key, arrays, fieldgrid.UnitFields(pack(arrays, 1, k, kernel, dtype), units, grid))
+        return self.unit[2]
+    
+    def has_units(self, arrays, groups, grid, theta=None, kernel='midpoint', dtype=numpy.float64):
+        '''Whether units() would reuse the last unit fields.'''
+        key = (grid, theta, kernel, numpy.dtype(dtype), tuple(groups))
+        return (self.unit is not None and self.unit[0] == key and len(arrays) == len(self.unit[1])
+                and all(a is b for a, b in zip(arrays, self.unit[1])))
+
+# Nodes along the longest side of a grid='auto' grid
+GRID_NODES = 32
+
+# Cost of a field grid, in (point, segment) pairs of the direct sum,
+# as measured on a helix, the toroid and two loops: building it, per
+# node and segment (sampling the nodes away from the wires, and
+# finding them), interpolating in it, per point, each call of its
+# field(), and adding up the wires' unit fields, per node and wire
+GRID_BUILD = 1.1
+GRID_INTERP = 9
+GRID_CALL = 2700
+GRID_COMBINE = .1
+
+def grid_pays(segs, points, grid, evals, calls, wires=1, frames=1, build=True):
+    '''Whether a grid with grid nodes along its longest side saves more
+    than it costs over frames frames, each traced with about evals field
+    evaluations in calls calls, spread like the points (see
+    fieldgrid.estimate()), for the given number of wires' currents.
+    build - whether the grid has to be built first
+    '''
+    nodes, far = fieldgrid.estimate(segs, points, grid)
+    saved = evals * far * (len(segs) - GRID_INTERP) - calls * GRID_CALL - GRID_COMBINE * nodes * wires
+    return frames * saved > (GRID_BUILD * nodes * len(segs) if build else 0)
+
+class Counted(object):
+    '''Wraps the segments (or octree) to count the field evaluations.
+    Only used when collecting statistics, so there's no cost otherwise.
+    '''
+    
+    def __init__(self, segs, stats):
+        self.segs = segs
+        self.stats = stats
+        stats['field_calls'] = 0
+        stats['field_points'] = 0
+        stats['segments_visited'] = 0
+    
+    def __len__(self):
+        return len(self.segs)
+    
+    def field(self, points):
+        self.stats['field_calls'] += 1
+        self.stats['field_points'] += len(points)
+        # For an octree this counts the segments a direct sum would visit.
+        self.stats['segments_visited'] += len(points) * len(self.segs)
+        return self.segs.field(points)
+
+# Shared segments of a tracing worker, see init_trace(), and the
+# field source made of them for the TracePool version it was made for
+trace_shared = None
+trace_version = None
+trace_source = None
+
+def init_trace(shared):
+    '''Sets the shared memory (see segments.share()) that a tracing
+    worker finds the segments of each frame in.
+    '''
+    global trace_shared, trace_version
+    trace_shared = shared
+    trace_version = None
+
+def trace(args):
+    '''Traces one piece of the seeds in a worker.
+    args is (i, seeds, tol, counting, version, layout, theta, sstep,
+    send): the segments are the ones in shared memory with the layout
+    from segments.fill(), grouped into an octree with theta if given,
+    and are only set up again when the version changes.
+    Returns i, the field lines, and with counting the statistics
+    of tracing them (otherwise None).
+    '''
+    global trace_version, trace_source
+    i, seeds, tol, counting, version, layout, theta, sstep, send = args
+    if version != trace_version:
+        trace_source = segments.attach(trace_shared, layout)
+        if theta:
+            trace_source = octree.Tree(trace_source, theta)
+        trace_version = version
+    
+    stats = {} if counting else None
+    source = trace_source
+    if counting:
+        source = Counted(source, stats)
+    if tol:
+        lines = fieldlines_adaptive(seeds, source, send=send, sstep=sstep, tol=tol, stats=stats)
+    else:
+        lines = fieldlines(seeds, source, send=send, sstep=sstep, stats=stats)
+    return i, lines, stats
+
+class TracePool(object):
+    '''Processes that trace the field lines of a frame together,
+    kept from frame to frame (see animate()).
+    The segments are put in shared memory once, so they aren't pickled
+    to each worker, and only copied in again when a frame's segments
+    change.  The memory has room to spare; a frame that needs more
+    starts the processes again with more.
+    '''
+    
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = None
+        self.shared = None
+        # The segments in shared memory, their layout (see
+        # segments.fill()) and a version number the workers know them by
+        self.segs = None
+        self.layout = None
+        self.version = 0
+        self.theta = None
+    
+    def load(self, segs, theta=None):
+        '''Puts segs in the shared memory, if they aren't there already.'''
+        if segs is self.segs and theta == self.theta:
+            return
+        if self.shared is None or not segments.fits(self.shared, segs):
+            self.close()
+            self.shared = segments.share(segs, 2 * len(segs))
+            self.pool = multiprocessing.Pool(self.workers, init_trace, (self.shared,))
+        self.layout = segments.fill(self.shared, segs)
+        self.segs = segs
+        self.theta = theta
+        self.version += 1
+    
+    def trace(self, starts, segs, theta=None, tol=None, sstep=.5, send=100, chunk=None, stats=None):
+        '''Creates the field lines for all the start points, split into
+        pieces of chunk seeds traced by the workers.
+        Each worker takes the next piece as soon as it's done with one,
+        so a few long lines don't hold the rest up, and the lines are
+        put back in the order of their seeds.
+        theta, tol, sstep, send - as in calculate()
+        chunk - seeds per piece, by default enough for four pieces per worker
+        stats - as in fieldlines(), plus the field evaluations of Counted
+        '''
+        self.load(segs, theta)
+        seeds = numpy.array(starts, dtype=float).reshape(-1, 3)
+        if chunk is None:
+            chunk = max(1, -(-len(seeds) // (4 * self.workers)))
+        pieces = [(i, seeds[i:i + chunk], tol, stats is not None, self.version, self.layout, theta,
+                   sstep, send) for i in range(0, len(seeds), chunk)]
+        
+        lines = [None] * len(seeds)
+        counts = []
+        for i, piece, piece_stats in self.pool.imap_unordered(trace, pieces, 1):
+            lines[i:i + len(piece)] = piece
+            counts.append((i, piece_stats))
+        
+        if stats is not None:
+            counts.sort(key=lambda c: c[0])
+            stats['evals'] = numpy.concatenate([c['evals'] for i, c in counts] or [numpy.zeros(0, dtype=int)])
+            stats['closed'] = numpy.concatenate([c['closed'] for i, c in counts] or [numpy.zeros(0, dtype=bool)])
+            for key in ('field_calls', 'field_points', 'segments_visited'):
+                stats[key] = stats.get(key, 0) + sum(c[key] for i, c in counts)
+        return lines
+    
+    def close(self):
+        '''Stops the processes.'''
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+def fieldlines_parallel(starts, segs, workers, theta=None, tol=None, sstep=.5, send=100,
+                        chunk=None, stats=None):
+    '''Creates the field lines for all the start points with a
+    TracePool of workers processes made just for them.
+    '''
+    pool = TracePool(workers)
+    try:
+        return pool.trace(starts, segs, theta, tol, sstep, send, chunk, stats)
+    finally:
+        pool.close()
+
+def calculate(wires, at=0, tol=None, sstep=.5, send=100, theta=None, kernel='midpoint', grid=None,
+              sep=None, stats=None, cache=None, workers=1, pool=None, dtype=numpy.float64):
+    '''Calculate the wire segments and field line points.
+    wires - wire specs, the arguments of split(), or shapes from
+            primitives.py; a spec can end with a symmetry (see
+            transforms()), and each copy of the wire is then a wire
+            of its own in the frame, and a current (see current())
+    tol - if given, trace with adaptive steps to this tolerance
+    sstep - step size of the field lines (the first step, with tol),
+            e.g. as tuned by B-tune.py
+    send - length of the field lines
+    theta - if given, sum the field with an octree using this opening angle
+            (e.g. .3), within octree.py's default error bound
+    kernel - 'midpoint' or 'exact' field of each segment, see segments.py
+    grid - if given, sample the field on a grid with this many nodes along
+           its longest side and trace through it, see fieldgrid.py;
+           the field of each wire is kept, so frames where the wires
+           don't move reuse it.  With 'auto', a grid of GRID_NODES is
+           only used when it saves the trace more than it costs (see
+           grid_pays(), going by the last frame's trace in cache, or
+           for the first frame by the seeds, and for wires that can't
+           move by the frames it has left); otherwise it sums directly
+    sep - if given, space the field lines about this far apart, starting
+          more lines where there's room, see fieldlines_even()
+    stats - if given, a dict that gets statistics of the frame:
+            wire build time and count, field evaluations, and the
+            evaluations, steps and early closing of each traced line
+            (the copies of symmetric wires aren't traced)
+    cache - a GeometryCache to reuse wires from earlier frames
+    workers - if more than one, trace the field lines in this many
+              processes, see TracePool; not with grid or sep, or
+              inside a worker of animate()
+    pool - a TracePool to trace with, kept from frame to frame,
+           instead of starting workers processes for this frame
+    dtype - precision of the field sums, numpy.float64 or numpy.float32
+            (see segments.py); animate() stores the frames of a single
+            precision calculation in single precision too
+    '''
+    if cache is None:
+        cache = GeometryCache()
+    built = cache.built
+    stime = time.time()
     
     # Reset field line starting points.
     starts = []
     
-    # Build the wires
-    w = [split(*wire, starts=starts, at=at) for wire in wires]
+    # Build the wires, and the copies of symmetric ones
+    w = []
+    arrays = []
+    seeds = []
+    # Current of each wire, of each point array, and the number of arrays of each wire
+    currents = []
+    array_currents = []
+    groups = []
+    for wire in wires:
+        points, s, a = cache.build(wire, at)
+        w.extend(points)
+        arrays.extend(a)
+        seeds.append((s, transforms(symmetry(wire))))
+        currents.append(current(wire, at))
+        array_currents.extend([currents[-1]] * len(a))
+        groups.append(len(a))
+    
+    # When every wire has the same symmetry, so does the field, and
+    # only the field lines of the wires themselves need tracing.
+    # Otherwise (or when spacing the lines out, since they can go
+    # anywhere) every copy gets its own field lines.
+    shared = set(symmetry(wire) for wire in wires)
+    copies = [numpy.identity(3)]
+    if len(shared) == 1 and None not in shared and not sep:
+        copies = seeds[0][1]
+        for s, mats in seeds:
+            starts.extend(s)
+    else:
+        for s, mats in seeds:
+            starts.extend(s)
+            for R in mats[1:]:
+                starts.extend(numpy.dot(numpy.reshape(s, (-1, 3)), R.T).tolist())
+    
+    # Pack the segments once for the whole frame.
+    segs = cache.pack(arrays, kernel, array_currents, dtype)
+    
+    # Group distant segments for big wire models
+    source = segs
+    if theta:
+        source = octree.Tree(segs, theta)
+    
+    # Sample the field once for many field lines, as the sum
+    # of each wire's field at unit current times its current
+    auto = grid == 'auto'
+    if auto:
+        # Going by the last frame's trace, or the seeds running the
+        # whole way, for the frames left if the wires stay put.
+        grid = GRID_NODES
+        evals, calls, points = cache.evals, cache.calls, cache.points
+        if evals is None:
+            calls = 4 * int(send / sstep) + 1
+            evals = calls * len(starts)
+            points = numpy.reshape(starts, (-1, 3))
+        left = 1
+        if all(static(wire) for wire in wires):
+            left = max(cache.frames - cache.traced, 1)
+        if not (len(segs) and len(points) and
+                grid_pays(segs, points, grid, evals, calls, len(wires), left,
+                          not cache.has_units(arrays, groups, grid, theta, kernel, dtype))):
+            grid = None
+    if grid and len(segs):
+        source = cache.units(arrays, groups, grid, theta, kernel, dtype).combine(currents, source)
+    ttime = time.time()
+    
+    if stats is not None:
+        stats['split_seconds'] = ttime - stime
+        stats['wires_built'] = cache.built - built
+        stats['segments'] = len(segs)
+        source = Counted(source, stats)
+    
+    # Create the fieldlines, tracing them all together
+    if sep:
+        # New lines start around the wires, not out to infinity.
+        bounds = None
+        if len(segs):
+            ends = numpy.concatenate([segs.start, segs.end])
+            lo, hi = ends.min(axis=0), ends.max(axis=0)
+            pad = .25 * (hi - lo).max()
+            bounds = (lo - pad, hi + pad)
+        l = fieldlines_even(starts, source, sep, bounds=bounds, send=send, sstep=sstep, stats=stats)
+    elif ((pool is not None or workers > 1) and not grid and len(starts) > 1
+          and not multiprocessing.current_process().daemon):
+        # One frame over many processes (the frame workers of
+        # animate() can't start processes of their own)
+        if pool is not None:
+            l = pool.trace(starts, segs, theta, tol, sstep, send, stats=stats)
+        else:
+            l = fieldlines_parallel(starts, segs, workers, theta, tol, sstep, send, stats=stats)
+    elif tol:
+        l = fieldlines_adaptive(starts, source, send=send, sstep=sstep, tol=tol, stats=stats)
+    else:
+        l = fieldlines(starts, source, send=send, sstep=sstep, stats=stats)
+    
+    if auto:
+        steps = [len(line) - 1 for line in l]
+        cache.evals = 4 * sum(steps) + len(l)
+        cache.calls = 4 * max(steps + [0]) + 1
+        cache.points = numpy.concatenate([numpy.zeros((0, 3))] + [numpy.array(line)[:, :3] for line in l if len(line)])
+        cache.points = cache.points[::max(1, len(cache.points) // 1000)]
+    cache.traced += 1
+    
+    if stats is not None:
+        stats['trace_seconds'] = time.time() - ttime
+        stats['grid'] = bool(grid and len(segs))
+        stats['steps'] = [len(line) - 1 for line in l]
+        stats['symmetry_copies'] = len(copies)
     
-    # Create the fieldlines
-    fieldlines = [ fieldline(p[0], p[1], p[2], w) for p in starts ]
+    # The field lines of the other copies, by symmetry
+    traced = l
+    for R in copies[1:]:
+        l = l + transform_lines(traced, R)
     
-    return w, fieldlines
+    return w, l
 
-def animate(wires, atstart, atend, atstep, prepend='', n=0):
-    '''Iterate through the animation and calculate wire segments 
-    and field line points for different moments in time.'''
-    at = atstart
+# Hash of the code that calculates the frames, see code_version()
+version = None
+
+def code_version():
+    '''Hash of the source of this file and the modules it computes
+    frames with, so changing the code changes every frame's key.
+    '''
+    global version
+    if version is None:
+        h = hashlib.sha1()
+        for module in (__file__, segments.__file__, octree.__file__,
+                       fieldgrid.__file__, frames.__file__):
+            if module.endswith('.pyc'):
+                module = module[:-1]
+            f = open(module, 'rb')
+            h.update(f.read())
+            f.close()
+        version = h.hexdigest()
+    return version
+
+def frame_key(wires, at, options, cache):
+    '''Key of a frame, a hash of everything it's calculated from:
+    the wires as built at time at (so wires that come out the same
+    give the same key, however they're written), their symmetry and
+    current, the calculate() options and the code version.
+    The number of workers doesn't change the frame, so it's left out.
+    '''
+    h = hashlib.sha1(code_version())
+    h.update(repr(sorted((key, value) for key, value in options.items() if key != 'workers')))
+    for wire in wires:
+        points, starts, arrays = cache.build(wire, at)
+        starts = numpy.asarray(starts, dtype=float).reshape(-1, 3)
+        h.update(repr((symmetry(wire), current(wire, at), arrays[0].shape, starts.shape)))
+        h.update(numpy.ascontiguousarray(arrays[0]).tobytes())
+        h.update(starts.tobytes())
+    return h.hexdigest()
+
+def publish(stored, name):
+    '''Puts the stored frame at name, linking it where possible.'''
+    if os.path.exists(name):
+        os.remove(name)
+    try:
+        os.link(stored, name)
+    except (AttributeError, OSError):
+        shutil.copyfile(stored, name)
+
+# Wires, calculate() options and wire cache for the frames
+# computed in this process.
+frame_wires = []
+frame_options = {}
+frame_cache = None
+# Tolerance to simplify the field lines of the files to, see frames.write()
+frame_simplify = None
+# TracePool that traces every frame, see animate()
+frame_pool = None
+
+def init_frames(wires, options={}, simplify=None, pool=None, frames=1):
+    '''Sets the wires, calculate() options, simplify tolerance and
+    TracePool used by frame(), and about how many frames this process
+    calculates (see GeometryCache).
+    Worker processes are forked, so the wires (and their lambdas)
+    are handed over here instead of being pickled with every frame.
+    '''
+    global frame_wires, frame_options, frame_cache, frame_simplify, frame_pool
+    frame_wires = wires
+    frame_options = options
+    frame_cache = GeometryCache(frames)
+    frame_simplify = simplify
+    frame_pool = pool
+
+def frame_dtype():
+    '''dtype of the frame files, the precision frame_options calculates in.'''
+    return '<f%d' % numpy.dtype(frame_options.get('dtype', numpy.float64)).itemsize
+
+def frame_name(prepend, n):
+    '''File name of frame n.'''
+    return '%s%04d%s' % (prepend, n, frames.EXT)
+
+def frame(args):
+    '''Calculate one frame and dump it into its file.
+    args is (n, at, prepend, profile, cachedir).
+    With cachedir, a frame already stored there under its key
+    (see frame_key()) is used instead of calculating it again.
+    Returns n, the time it took to calculate, and with profile
+    a record of the frame's statistics (otherwise None).
+    '''
+    n, at, prepend, profile, cachedir = args
+    stats = {} if profile else None
+    name = frame_name(prepend, n)
     
-    while at < atend:
+    # Time how long it takes to calculate
+    stime = time.time()
+    
+    stored = None
+    built = frame_cache.built
+    split_seconds = 0
+    if cachedir:
+        # The key is made from the built wires, which calculate() then
+        # reuses, so their build is timed and counted here.
+        for wire in frame_wires:
+            frame_cache.build(wire, at)
+        split_seconds = time.time() - stime
+        built = frame_cache.built - built
         
-        # Time how long it takes to calculate
-        stime = time.time()
-        w, l = calculate(wires, at)
-        print n, time.time() - stime
+        options = frame_options
+        if frame_simplify is not None:
+            options = dict(options, simplify=frame_simplify)
+        stored = os.path.join(cachedir, frame_key(frame_wires, at, options, frame_cache) + frames.EXT)
+        if frames.complete(stored):
+            publish(stored, name)
+            elapsed = time.time() - stime
+            record = None
+            if profile:
+                record = {'frame': n, 'at': at, 'cached': True, 'calculate_seconds': elapsed,
+                          'split_seconds': split_seconds, 'wires_built': built}
+            return n, elapsed, record
+    else:
+        built = 0
+    
+    w, l = calculate(frame_wires, at, stats=stats, cache=frame_cache, pool=frame_pool, **frame_options)
+    elapsed = time.time() - stime
+    
+    # Dump the data into the file
+    dtime = time.time()
+    if stored:
+        frames.write(stored, w, l, frame_dtype(), frame_simplify)
+        publish(stored, name)
+    else:
+        frames.write(name, w, l, frame_dtype(), frame_simplify)
+    
+    record = None
+    if profile:
+        record = {'frame': n, 'at': at, 'cached': False,
+                  'calculate_seconds': elapsed,
+                  'dump_seconds': time.time() - dtime,
+                  'lines': len(l),
+                  'closed_lines': int(stats['closed'].sum())}
+        stats['split_seconds'] += split_seconds
+        stats['wires_built'] += built
+        # Plain numbers and lists, for json
+        for key, value in stats.items():
+            if isinstance(value, numpy.ndarray):
+                value = value.tolist()
+            record[key] = value
+    
+    return n, elapsed, record
+
+def resample(points, m):
+    '''m points evenly spaced by arc length along the polyline points.'''
+    points = numpy.asarray(points, dtype=float)
+    if m == 0 or len(points) == 0:
+        return numpy.zeros((0, points.shape[1]))
+    d = numpy.sqrt(((points[1:, :3] - points[:-1, :3]) ** 2).sum(axis=1))
+    s = numpy.concatenate([[0], numpy.cumsum(d)])
+    if s[-1] == 0:
+        return numpy.repeat(points[:1], m, axis=0)
+    u = numpy.linspace(0, s[-1], m)
+    return numpy.array([numpy.interp(u, s, points[:, i]) for i in range(points.shape[1])]).T
+
+def blend(a, b, x):
+    '''Polylines x of the way from the polylines a to b (paired by index),
+    each resampled by arc length to its in-between number of points.
+    '''
+    out = []
+    for p, q in zip(a, b):
+        m = int(round((1 - x) * len(p) + x * len(q)))
+        out.append((1 - x) * resample(p, m) + x * resample(q, m))
+    return out
+
+def differ(a, b, keytol):
+    '''Whether the polylines a and b don't pair up, or any pair
+    is more than keytol apart (resampled by arc length).
+    '''
+    if len(a) != len(b):
+        return True
+    for p, q in zip(a, b):
+        if (len(p) == 0) != (len(q) == 0):
+            return True
+        m = max(len(p), len(q))
+        d = resample(p, m)[:, :3] - resample(q, m)[:, :3]
+        if m and numpy.sqrt((d ** 2).sum(axis=1)).max() > keytol:
+            return True
+    return False
+
+def tween(todo, keys, keytol, compute):
+    '''Fills in the frames between the calculated frames keys of todo.
+    Two neighbouring frames are interpolated between if they're within
+    keytol of each other (see differ()); otherwise the middle frame is
+    calculated and each half is filled in the same way.
+    The middle frames of each round are calculated together with
+    compute, which takes a list of todo entries and yields their
+    results in order (e.g. the imap of a pool over frame()).
+    Yields the results of each frame like frame() does, as they're done.
+    '''
+    gaps = [(i, j) for i, j in zip(keys, keys[1:]) if j - i > 1]
+    while gaps:
+        split = []
+        for i, j in gaps:
+            prepend, profile = todo[i][2:4]
+            a = frames.read(frame_name(prepend, todo[i][0]))
+            b = frames.read(frame_name(prepend, todo[j][0]))
+            if differ(a[0], b[0], keytol) or differ(a[1], b[1], keytol):
+                split.append((i, (i + j) // 2, j))
+                continue
+            
+            for m in range(i + 1, j):
+                stime = time.time()
+                n, at = todo[m][:2]
+                x = (at - todo[i][1]) / float(todo[j][1] - todo[i][1])
+                frames.write(frame_name(prepend, n), blend(a[0], b[0], x), blend(a[1], b[1], x),
+                             frame_dtype(), frame_simplify)
+                elapsed = time.time() - stime
+                record = None
+                if profile:
+                    record = {'frame': n, 'at': at, 'interpolated': True, 'calculate_seconds': elapsed}
+                yield n, elapsed, record
         
-        # Dump the data into the file
-        f = open('%s%04d.txt' % (prepend, n), 'w')
-        pickle.dump([w, l], f)
-        f.close()
+        # Every middle frame is written before the next round reads it.
+        for result in compute([todo[mid] for i, mid, j in split]):
+            yield result
+        gaps = [gap for i, mid, j in split for gap in ((i, mid), (mid, j)) if gap[1] - gap[0] > 1]
+
+def animate(wires, atstart, atend, atstep, prepend='', n=0, processes=1,
+            profile=False, cachedir=None, keyframes=1, keytol=.5, simplify=None,
+            **options):
+    '''Iterate through the animation and calculate wire segments 
+    and field line points for different moments in time.
+    processes - number of worker processes to spread the frames over.
+    profile - write statistics of each frame as a line of json
+              to prepend + 'profile.jsonl'
+    cachedir - folder to keep every frame in by its key; frames
+               already there are reused, so an interrupted or
+               changed run only calculates the frames it's missing
+    keyframes - calculate every this many frames, and interpolate the
+                frames between them where they're close enough
+    keytol - how far apart (at most) the wires and field lines of two
+             keyframes can be to interpolate between them, see tween()
+    simplify - if given, simplify the field lines in the files to this
+               tolerance, keeping their detail for coarser levels
+               (see frames.write())
+    options - passed on to calculate(), e.g. tol or sstep; with workers, the
+              one TracePool traces every frame (when processes
+              doesn't spread them already)
+    '''
+    if cachedir and not os.path.isdir(cachedir):
+        os.makedirs(cachedir)
+    
+    # Determine every frame up front, so the moments in time are
+    # the same however the frames are computed.
+    todo = []
+    at = atstart
+    while at < atend:
+        todo.append((n, at, prepend, profile, cachedir))
         
         # Increment counters
         at += atstep
         n += 1
+    
+    # The frames to calculate, with the last one always a keyframe
+    keys = range(0, len(todo), max(keyframes, 1))
+    if todo and keys[-1] != len(todo) - 1:
+        keys.append(len(todo) - 1)
+    
+    # Interpolated frames are written by this process.
+    tracer = None
+    if processes <= 1 and options.get('workers', 1) > 1:
+        tracer = TracePool(options['workers'])
+    init_frames(wires, options, simplify, tracer, len(todo))
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, init_frames,
+                                    (wires, options, simplify, None, -(-len(todo) // processes)))
+        # Results come back in the order of each batch.
+        compute = lambda entries: pool.imap(frame, entries)
+    else:
+        compute = lambda entries: (frame(entry) for entry in entries)
+    
+    # Each frame is reported as soon as it's done.
+    log = open(prepend + 'profile.jsonl', 'a') if profile else None
+    def report(results):
+        for n, elapsed, record in results:
+            print n, elapsed
+            if log:
+                log.write(json.dumps(record, sort_keys=True) + '\n')
+                log.flush()
+    
+    report(compute([todo[i] for i in keys]))
+    report(tween(todo, keys, keytol, compute))
+    if log:
+        log.close()
+    if processes > 1:
+        pool.close()
+        pool.join()
+    if tracer:
+        tracer.close()
 
 if __name__ == "__main__":
     # animation
@@ -254,6 +1317,8 @@ if __name__ == "__main__":
     atstart = 0 + n * atstep
     atend = 1
     prepend = 'line_'
+    processes = multiprocessing.cpu_count() # worker processes
+    cachedir = 'frame_cache' # finished frames, reused when run again
     
     # Single short wire.
     def a(t, o, at, fl):
@@ -278,33 +1343,27 @@ if __name__ == "__main__":
 #             ]
 
     # toroid
-    from numpy.ma.core import cos, sin
+    from primitives import Loop
     
     toroid_r = 1
     r = 1
-    rs = 0
-    re = 2 * math.pi
-    ri = math.pi / 30 # rate
+    ri = 60 # segments per loop
     offset = [-.25, -.5, -.75]
     start_toroid_r = 5
     nl = 2
+    loops = 8
+    # One loop, copied around the z axis
     wires = [
-         [rs, re, ri,
-          lambda t, o, at: (cos(0 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), sin(0 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), (r + o) * sin(t) ), offset, nl, lambda at: at >= 0],
-         [rs, re, ri,
-          lambda t, o, at: (cos(1 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), sin(1 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), (r + o) * sin(t) ), offset, nl, lambda at: at >= 0],
-         [rs, re, ri,
-          lambda t, o, at: (cos(2 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), sin(2 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), (r + o) * sin(t) ), offset, nl, lambda at: at >= 0],
-         [rs, re, ri,
-          lambda t, o, at: (cos(3 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), sin(3 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), (r + o) * sin(t) ), offset, nl, lambda at: at >= 0],
-         [rs, re, ri,
-          lambda t, o, at: (cos(4 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), sin(4 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), (r + o) * sin(t) ), offset, nl, lambda at: at >= 0],
-         [rs, re, ri,
-          lambda t, o, at: (cos(5 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), sin(5 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), (r + o) * sin(t) ), offset, nl, lambda at: at >= 0],
-         [rs, re, ri,
-          lambda t, o, at: (cos(6 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), sin(6 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), (r + o) * sin(t) ), offset, nl, lambda at: at >= 0],
-         [rs, re, ri,
-          lambda t, o, at: (cos(7 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), sin(7 * 2 * math.pi / 8) * (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), (r + o) * sin(t) ), offset, nl, lambda at: at >= 0],
+         Loop(r, lambda at: (toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0), 0, 0), 'y', ri,
+              offsets=offset, nlines=nl, valid=lambda at: at >= 0, symmetry=('rotate', loops)),
          ]
+    
+    # The same loop as a wire spec
+#    from numpy.ma.core import cos, sin
+#    wires = [
+#         [0, 2 * math.pi, math.pi / 30,
+#          lambda t, o, at: ((toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * cos(t)), 0, (r + o) * sin(t) ), offset, nl, lambda at: at >= 0,
+#          ('rotate', loops)],
+#         ]
 
-    animate(wires, atstart, atend, atstep, prepend, n)
+    animate(wires, atstart, atend, atstep, prepend, n, processes, cachedir=cachedir)
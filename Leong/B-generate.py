@@ -10,23 +10,88 @@ with guidance from Professor Wolf
 from mayavi import mlab
 from mayavi.tools.helper_functions import plot3d
 from tvtk.tools import visual
+import Queue
+import frames
 import glob
+import numpy
 import os
-import pickle
+import threading
 
-def draw(name, w=[], l=[], mag=False):
-    # Load the data into memory.
-    f = open(name, 'r')
-    wires, fieldlines = pickle.load(f)
-    f.close()
+def pixel(distance, width=1280, angle=30):
+    '''Size of one pixel at distance from the camera, for a view
+    width pixels wide with the given view angle (in degrees).
+    Field lines simplified to this tolerance look the same.
+    '''
+    return 2 * distance * numpy.tan(numpy.radians(angle) / 2) / width
+
+def prepare(name, tol=None):
+    '''Loads a frame and gets it ready to plot.
+    Returns (wires, fieldlines, vmin, vmax): the wires as (x, y, z)
+    and the field lines as (x, y, z, scalars) contiguous arrays,
+    and the range of the scalars over all the field lines.
+    tol - if given, simplify the field lines to this tolerance
+    '''
+    # Load the data, either format.
+    # Binary frames are memory-mapped rather than read in.
+    wires, fieldlines = frames.read(name, tol)
+    
+    # Split x, y, z (and b) into their own arrays.
+    wires = [tuple(numpy.array(c) for c in wire.T) for wire in wires if len(wire) > 0]
+    fieldlines = [tuple(numpy.array(c) for c in line.T) for line in fieldlines]
+    
+    # find vmax, vmin for this set of data
+    vmax = -1
+    vmin = -1
+    if fieldlines:
+        vmax = max(line[3].max() for line in fieldlines)
+        vmin = min(line[3].min() for line in fieldlines)
+    
+    return wires, fieldlines, vmin, vmax
+
+def reader(names, queue, tol=None):
+    '''Prepares the frames one after another in the background.
+    Puts (name, frame) on the queue, then None at the end
+    (or (name, error) if a frame can't be read).
+    The queue is bounded, so only a few frames are held at once.
+    '''
+    for name in names:
+        try:
+            queue.put((name, prepare(name, tol)))
+        except Exception, e:
+            # Hand the error over to the renderer, and stop.
+            queue.put((name, e))
+            return
+    queue.put(None)
+
+def stream(names, prefetch=4, tol=None):
+    '''Yields (name, frame) for each name, as prepared by prepare(),
+    reading up to prefetch frames ahead in a background thread.
+    '''
+    queue = Queue.Queue(maxsize=prefetch)
+    thread = threading.Thread(target=reader, args=(names, queue, tol))
+    thread.daemon = True
+    thread.start()
+    
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        if isinstance(item[1], Exception):
+            raise item[1]
+        yield item
+
+def draw(frame, w=[], l=[], mag=False):
+    '''Displays a frame, reusing the plots in w and l.
+    frame is either a file name or a frame from prepare().
+    '''
+    if isinstance(frame, basestring):
+        frame = prepare(frame)
+    wires, fieldlines, vmin, vmax = frame
     
     # Display each wire.
     wi = 0
     for wire in wires:
-        if len(wire) <= 0:
-            continue
-        
-        wx, wy, wz = zip(*wire) # split x, y, z from w
+        wx, wy, wz = wire
         scalars = [1] * len(wx)
         if wi < len(w):
             w[wi].trait_set(visible=True)
@@ -40,22 +105,10 @@ def draw(name, w=[], l=[], mag=False):
     for i in range(wi + 1, len(w)):
         w[i].trait_set(visible=False)
 
-    # find vmax, vmin for this set of data
-    vmax = -1;
-    vmin = -1;
-    for line in fieldlines:
-        lx, ly, lz, scalars = zip(*line)
-        m = max(scalars)
-        if m > vmax or vmax == -1:
-            vmax = m
-        m = min(scalars)
-        if m < vmin or vmin == -1:
-            vmin = m
-    
     # Display each fieldline
     li = 0
     for line in fieldlines:
-        lx, ly, lz, scalars = zip(*line)
+        lx, ly, lz, scalars = line
         
         if li < len(l):
             l[li].trait_set(visible=True)
@@ -84,26 +137,32 @@ if __name__ == "__main__":
     fig = mlab.figure(bgcolor=(0, 0, 0), size=(1280, 720))
     visual.set_viewer(fig)
     
-    # Iterate through all the files in this folder.
-    for name in glob.glob(os.path.join(path, '*.txt')):
-        num = int(name[-8:-4])
-        
-        if num == 1:
-            continue
+    # Iterate through all the frames in this folder.
+    # Use the binary frames if there are any, otherwise the old pickles.
+    names = sorted(glob.glob(os.path.join(path, '*[0-9][0-9][0-9][0-9]' + frames.EXT)))
+    if not names:
+        names = sorted(glob.glob(os.path.join(path, '*[0-9][0-9][0-9][0-9].txt')))
+    names = [name for name in names if int(name[-8:-4]) != 1]
+    
+    # Camera distance; field line detail smaller than a pixel is left out.
+    distance = 6 # line
+    #distance = 20 # toroid
     
+    # The next frames are read while this one renders and saves.
+    for name, frame in stream(names, tol=pixel(distance)):
         # Disable rendering for faster speed.
         fig.scene.disable_render = True
-        draw(name, mag=True)
+        draw(frame, mag=True)
         fig.scene.disable_render = False
     
         # Set view and save image.
         
         # line
-        mlab.view(azimuth=45, elevation=90, distance=6, reset_roll=True, focalpoint=[0, 0, 0])
+        mlab.view(azimuth=45, elevation=90, distance=distance, reset_roll=True, focalpoint=[0, 0, 0])
         mlab.roll(roll=45)
         
         # toroid
-        #mlab.view(azimuth=90, elevation=45, distance=20, reset_roll=True, focalpoint=[0, 0, 0])
+        #mlab.view(azimuth=90, elevation=45, distance=distance, reset_roll=True, focalpoint=[0, 0, 0])
         
         mlab.savefig(name[:-3] + 'png')
         
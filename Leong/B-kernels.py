@@ -0,0 +1,82 @@
+'''
+Compares the midpoint and exact segment kernels in segments.py.
+
+For the toroid (at at=0) and the solenoid of scenes.py, finds how
+many segments per turn each kernel needs before the field at a set of probe points is within
+the target error of a converged reference:
+
+    python B-kernels.py [target]
+
+The error is the largest difference over the probe points, relative
+to the rms reference field.  Probe points right next to a wire are
+left out, where the field of a thin wire has no converged value.
+'''
+
+from segments import Segments
+import imp
+import math
+import numpy
+import os
+import scenes
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+calc = imp.load_source('B_calculate', os.path.join(here, 'B-calculate.py'))
+
+def build(name, n, at=0):
+    '''Point arrays of the wires of a scene from scenes.py, with n
+    segments for each turn of a wire (each loop of the toroid, each
+    turn of the solenoid).
+    '''
+    wires = scenes.SCENES[name]()
+    turns = [(wire[1] - wire[0]) / (2 * math.pi) for wire in wires]
+    wires = scenes.resplit(wires, [int(round(t * n)) for t in turns])
+    return [numpy.array(calc.split(*wire[:7], starts=[], at=at)) for wire in wires]
+
+def segments(wires, kernel):
+    '''Segments of the wires with the given kernel.'''
+    start = numpy.concatenate([w[:-1] for w in wires])
+    end = numpy.concatenate([w[1:] for w in wires])
+    return Segments(start, end, kernel=kernel)
+
+def sweep(name, counts, near, target):
+    '''Prints the error of each kernel for each segment count.'''
+    # Converged reference: exact kernel, 8 times the finest wire.
+    ref = segments(build(name, counts[-1] * 8), 'exact')
+    probes = scenes.probes(name)
+
+    # Leave out the probe points next to a wire.
+    dist = numpy.array([numpy.sqrt(((ref.mid - p) ** 2).sum(axis=1)).min() for p in probes])
+    probes = probes[dist > near]
+    exact = ref.field(probes)
+    scale = math.sqrt((exact ** 2).sum(axis=1).mean())
+
+    print '%s: %d probe points, target error %g' % (name, len(probes), target)
+    print '%8s %9s %12s %9s %12s %9s' % ('per turn', 'segments', 'midpoint', 'time', 'exact', 'time')
+    needed = {}
+    for n in counts:
+        row = []
+        for kernel in ('midpoint', 'exact'):
+            segs = segments(build(name, n), kernel)
+            stime = time.time()
+            b = segs.field(probes)
+            elapsed = time.time() - stime
+            err = numpy.sqrt(((b - exact) ** 2).sum(axis=1)).max() / scale
+            if err <= target and kernel not in needed:
+                needed[kernel] = len(segs)
+            row += [err, elapsed]
+        print '%8d %9d %12.3e %8.4fs %12.3e %8.4fs' % tuple([n, len(segs)] + row)
+
+    for kernel in ('midpoint', 'exact'):
+        if kernel in needed:
+            print '%s kernel needs %d segments' % (kernel, needed[kernel])
+        else:
+            print '%s kernel does not reach the target' % kernel
+    print
+
+if __name__ == "__main__":
+    target = float(sys.argv[1]) if len(sys.argv) > 1 else 1e-3
+
+    sweep('toroid', [8, 16, 32, 64, 128, 256, 512], .1, target)
+    sweep('solenoid', [8, 16, 32, 64, 128, 256, 512], 5, target)
@@ -0,0 +1,116 @@
+'''
+Compares single precision calculation and storage with double
+precision on the reference scenes in scenes.py.
+
+For each scene it reports
+    field  - the largest error of the single precision field at the
+             scene's probe points, relative to the rms double precision
+             field (leaving out points right next to a wire), and the
+             time of each
+    lines  - the largest distance of a single precision frame's field
+             lines from the double precision ones, and the time of each
+    stored - the largest error of the frame's points read back from a
+             single precision file, and the size of each file
+
+    python B-precision.py [--scenes single,toroid,solenoid] [--at 1]
+                          [-o results.json]
+'''
+
+from metrics import line_error
+import argparse
+import imp
+import json
+import numpy
+import os
+import scenes
+import shutil
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+calc = imp.load_source('B_calculate', os.path.join(here, 'B-calculate.py'))
+frames = calc.frames
+
+def timed(f):
+    '''f() and the time it took.'''
+    stime = time.time()
+    result = f()
+    return result, time.time() - stime
+
+def probe_points(name, segs):
+    '''The scene's probe points, leaving out the ones closer to a wire
+    than two of its longest segments.
+    '''
+    probes = scenes.probes(name)
+    near = 2 * numpy.sqrt((segs.dl ** 2).sum(axis=1)).max()
+    keep = [numpy.sqrt(((segs.mid - p) ** 2).sum(axis=1)).min() > near for p in probes]
+    return probes[numpy.array(keep, dtype=bool)]
+
+def stored_error(a, b):
+    '''Largest difference of the points of two lists of polylines.'''
+    return max([numpy.abs(numpy.asarray(p, dtype=float) - numpy.asarray(q, dtype=float)).max()
+                for p, q in zip(a, b) if len(p)] or [0])
+
+def compare(name, at):
+    '''Compares the precisions on one scene.  Returns its record.'''
+    wires = scenes.SCENES[name]()
+    record = {'scene': name}
+
+    # The field at the probe points
+    w = [calc.split(*wire[:7], starts=[], at=at) for wire in wires]
+    double = calc.pack(w, calc.I, calc.k)
+    single = calc.pack(w, calc.I, calc.k, dtype=numpy.float32)
+    probes = probe_points(name, double)
+    b64, record['field_seconds_double'] = timed(lambda: double.field(probes))
+    b32, record['field_seconds_single'] = timed(lambda: single.field(probes))
+    record['probes'] = len(probes)
+    record['field_error'] = numpy.sqrt(((b32 - b64) ** 2).sum(axis=1)).max() / \
+        numpy.sqrt((b64 ** 2).sum(axis=1).mean())
+
+    # The field lines of a frame
+    (w64, l64), record['calculate_seconds_double'] = timed(lambda: calc.calculate(wires, at))
+    (w32, l32), record['calculate_seconds_single'] = timed(
+        lambda: calc.calculate(wires, at, dtype=numpy.float32))
+    record['lines'] = len(l64)
+    record['line_error'] = line_error(l32, l64) if len(l32) == len(l64) else float('inf')
+
+    # The frame read back from each kind of file
+    folder = tempfile.mkdtemp()
+    try:
+        for dtype in ('<f8', '<f4'):
+            f = os.path.join(folder, 'frame' + dtype[1:] + frames.EXT)
+            frames.write(f, w64, l64, dtype)
+            record['bytes_' + dtype[1:]] = os.path.getsize(f)
+            rw, rl = frames.read(f)
+            record['stored_error_' + dtype[1:]] = max(stored_error(rw, w64), stored_error(rl, l64))
+    finally:
+        shutil.rmtree(folder)
+    return record
+
+def show(record):
+    '''Prints a scene's record.'''
+    r = record
+    print '%s:' % r['scene']
+    print '  field   %3d probes  error %.3g  %.4fs double, %.4fs single' % (
+        r['probes'], r['field_error'], r['field_seconds_double'], r['field_seconds_single'])
+    print '  lines   %3d lines   error %.3g  %.4fs double, %.4fs single' % (
+        r['lines'], r['line_error'], r['calculate_seconds_double'], r['calculate_seconds_single'])
+    print '  stored              error %.3g  %d bytes double, %d bytes single' % (
+        r['stored_error_f4'], r['bytes_f8'], r['bytes_f4'])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare single and double precision on reference scenes.')
+    parser.add_argument('--scenes', default='single,toroid,solenoid', help='comma separated scenes')
+    parser.add_argument('--at', type=float, default=1, help='animation time of the frame')
+    parser.add_argument('-o', '--output', help='save results as JSON to this file')
+    args = parser.parse_args()
+
+    records = []
+    for name in args.scenes.split(','):
+        records.append(compare(name, args.at))
+        show(records[-1])
+
+    if args.output:
+        f = open(args.output, 'w')
+        json.dump({'at': args.at, 'records': records}, f, indent=1, sort_keys=True)
+        f.close()
@@ -0,0 +1,246 @@
+'''
+Finds the cheapest wire discretization and step size that keep the
+field lines of a scene within a target error.
+
+For a scene from scenes.py it first makes a converged reference:
+the wires split ever finer (with the exact kernel) until the field
+along the field lines stops changing, and the field lines traced
+through them with small adaptive steps.  Then it tries settings of
+    segments - number of segments of each wire, as a multiple of the
+               scene's own (so its tstep, e.g. ri, over that)
+    sstep    - step size of the field lines
+    kernel   - midpoint or exact
+in order of their estimated cost, and stops at the first one whose
+field lines all stay within the target distance of the reference,
+and whose field along them is within btol of the reference (by
+default the target, relative).  The field matters as much as the
+lines: it's stored with every point and colors the lines.
+A setting coarser than one that failed isn't tried.
+
+    python B-tune.py [--scene toroid] [--target .01] [-o tuned.json]
+
+The field lines start from the scene's own start points for every
+setting, so only the accuracy of the wires and steps is measured.
+'''
+
+from metrics import field_error, line_error
+import argparse
+import imp
+import json
+import math
+import numpy
+import os
+import scenes
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+calc = imp.load_source('B_calculate', os.path.join(here, 'B-calculate.py'))
+
+# Settings tried: multiples of the scene's segments, and step sizes
+SCALES = [1 / 16., 1 / 8., 1 / 4., 1 / 2., 1, 2, 4, 8, 16]
+SSTEPS = [1, .5, .25, .1, .05]
+KERNELS = ['midpoint', 'exact']
+
+# Relative cost of one (point, segment) pair of each kernel
+KERNEL_COST = {'midpoint': 1, 'exact': 2}
+
+def resplit(wires, scale):
+    '''The wire specs with scale times as many segments each.'''
+    return scenes.resplit(wires, [int(round(scenes.segment_count(wire) * scale)) for wire in wires])
+
+def build(wires, scale, at, kernel):
+    '''Packs the segments of the wires split scale times as finely.'''
+    w = [calc.split(*wire[:7], starts=[], at=at) for wire in resplit(wires, scale)]
+    return calc.pack(w, calc.I, calc.k, kernel)
+
+def reference(wires, at, starts, send, target, rtol, max_segments, seconds=20):
+    '''Converged reference for the scene: the segments, the field lines
+    (traced a few steps past send, so every line has its whole reference)
+    and the field at their points.
+    The wires are split twice as finely until the field along the
+    lines changes less than rtol, or there would be more than
+    max_segments segments, or the next round and the trace through it
+    would take the whole reference past seconds.  Tracing costs about
+    the same per segment at every scale, so it's timed once, at the
+    scene's own segments.
+    The lines close within the smallest step tried, so small loops
+    aren't cut short.
+    '''
+    def trace(segs):
+        return calc.fieldlines_adaptive(starts, segs, send=send + 3 * max(SSTEPS), sstep=min(SSTEPS),
+                                        tol=target * 1e-3, hmax=.1)
+    def join(lines):
+        return numpy.concatenate([numpy.array(line)[:, :3] for line in lines])
+
+    stime = time.time()
+    scale = 1
+    segs = build(wires, scale, at, 'exact')
+    lines = trace(segs)
+    per = (time.time() - stime) / max(len(segs), 1)
+
+    # The field along the lines, to check convergence at
+    points = join(lines)
+    b = segs.field(points)
+    change = None
+    converged = False
+    last = 0
+    while (2 * len(segs) <= max_segments and
+           time.time() - stime + 2 * last + 2 * len(segs) * per <= seconds):
+        rtime = time.time()
+        scale *= 2
+        finer = build(wires, scale, at, 'exact')
+        fb = finer.field(points)
+        last = time.time() - rtime
+        change = field_error(segs, points, fb)
+        segs, b = finer, fb
+        if change < rtol:
+            converged = True
+            break
+
+    if scale > 1:
+        lines = trace(segs)
+        points = join(lines)
+        b = segs.field(points)
+    return {'segments': len(segs), 'scale': scale, 'converged': converged, 'change': change,
+            'seconds': time.time() - stime, 'lines': lines, 'points': points, 'b': b}
+
+def trial(wires, at, starts, send, scale, sstep, kernel, ref, repeat=1):
+    '''Runs one setting: splits and packs the wires and traces the lines,
+    timing the best of repeat runs.  Returns its record.
+    '''
+    best = None
+    for i in range(repeat):
+        stats = {}
+        stime = time.time()
+        segs = build(wires, scale, at, kernel)
+        lines = calc.fieldlines(starts, segs, send=send, sstep=sstep, stats=stats)
+        elapsed = time.time() - stime
+        if best is None or elapsed < best:
+            best = elapsed
+    return {'scale': scale, 'sstep': sstep, 'kernel': kernel,
+            'segments': len(segs), 'seconds': best,
+            'evals': int(stats['evals'].sum()),
+            'pairs': int(stats['evals'].sum()) * len(segs),
+            'line_error': line_error(lines, ref['lines']),
+            'field_error': field_error(segs, ref['points'], ref['b'])}
+
+def estimate(segments, sstep, kernel, send):
+    '''Estimated cost of a setting, as (point, segment) pairs
+    of a line that runs the whole way.
+    '''
+    return segments * (send / sstep) * 4 * KERNEL_COST[kernel]
+
+def tune(name, target, at=1, send=100, btol=None, rtol=None, max_segments=200000,
+         seconds=20, repeat=1, log=None):
+    '''Cheapest setting for the scene that keeps its field lines
+    within target of the reference, and the field along them within
+    btol of it, relative (by default target).
+    rtol - how little the reference field has to change to have
+           converged, by default target / (10 send)
+    max_segments, seconds - limits of the reference, see reference()
+    log - if given, called with each record as it's measured
+    Returns (reference, records of the settings tried, chosen setting,
+    record of the scene's own setting).
+    '''
+    wires = scenes.SCENES[name]()
+    if btol is None:
+        btol = target
+    if rtol is None:
+        rtol = target / (10. * send)
+
+    # Start points at the scene's own discretization, for every setting
+    starts = []
+    for wire in wires:
+        calc.split(*wire[:7], starts=starts, at=at)
+
+    ref = reference(wires, at, starts, send, target, rtol, max_segments, seconds)
+    base = sum(scenes.segment_count(wire) for wire in wires)
+
+    candidates = sorted(((estimate(base * scale, sstep, kernel, send), scale, sstep, kernel)
+                         for scale in SCALES for sstep in SSTEPS for kernel in KERNELS))
+    tried = []
+    failed = []
+    chosen = None
+    for cost, scale, sstep, kernel in candidates:
+        # Coarser than a failed setting in every way
+        if any(kernel == f['kernel'] and scale <= f['scale'] and sstep >= f['sstep']
+               for f in failed):
+            continue
+        record = trial(wires, at, starts, send, scale, sstep, kernel, ref, repeat)
+        record['ok'] = bool(record['line_error'] <= target and record['field_error'] <= btol)
+        tried.append(record)
+        if log:
+            log(record)
+        if record['ok']:
+            chosen = record
+            break
+        failed.append(record)
+
+    # The scene as it's calculated now, to compare with
+    default = trial(wires, at, starts, send, 1, .5, 'midpoint', ref, repeat)
+    default['ok'] = bool(default['line_error'] <= target and default['field_error'] <= btol)
+    return ref, tried, chosen, default
+
+def show(record):
+    '''One line for a setting's record.'''
+    print '%8.4g %6.3g %-9s %8d %10.4f %12.4g %11.3g %11.3g  %s' % (
+        record['scale'], record['sstep'], record['kernel'], record['segments'],
+        record['seconds'], record['pairs'], record['line_error'], record['field_error'],
+        'ok' if record['ok'] else '')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tune the wire discretization and step size of a scene.')
+    parser.add_argument('--scene', default='toroid', help='scene from scenes.py')
+    parser.add_argument('--target', type=float, default=.01,
+                        help='largest allowed distance of a field line from the reference')
+    parser.add_argument('--btol', type=float,
+                        help='largest allowed relative field error (by default the target)')
+    parser.add_argument('--at', type=float, default=1, help='animation time of the frame')
+    parser.add_argument('--send', type=float, default=100, help='length of the field lines')
+    parser.add_argument('--max-segments', type=int, default=200000,
+                        help='most segments for the reference')
+    parser.add_argument('--seconds', type=float, default=20,
+                        help='most time to spend refining the reference')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per setting (best is kept)')
+    parser.add_argument('-o', '--output', help='save the results as JSON to this file')
+    args = parser.parse_args()
+
+    print '%8s %6s %-9s %8s %10s %12s %11s %11s' % (
+        'segments', 'sstep', 'kernel', 'count', 'seconds', 'pairs', 'line error', 'field error')
+    stime = time.time()
+    ref, tried, chosen, default = tune(args.scene, args.target, args.at, args.send, args.btol,
+                                       max_segments=args.max_segments, seconds=args.seconds,
+                                       repeat=args.repeat, log=show)
+    print 'reference: %d segments (x%d), last change %.3g%s, %.1fs; %.1fs in all' % (
+        ref['segments'], ref['scale'], ref['change'] or 0,
+        '' if ref['converged'] else ' (not converged)', ref['seconds'], time.time() - stime)
+    print 'as it is:'
+    show(default)
+
+    wires = scenes.SCENES[args.scene]()
+    if chosen is None:
+        print 'no setting is within %g' % args.target
+        if not ref['converged']:
+            print 'the reference did not converge; try a bigger --seconds or --max-segments'
+    else:
+        print 'chosen:'
+        show(chosen)
+        # A turn of t is a turn of a Loop or Helix, whose n is per turn.
+        for i, wire in enumerate(resplit(wires, chosen['scale'])):
+            print 'wire %d: %d segments (n=%d per turn of t, as for a Loop or Helix), tstep %.6g' % (
+                i, scenes.segment_count(wire), int(round(2 * math.pi / wire[2])), wire[2])
+        print 'x%.2f the speed of the scene as it is; for calculate() or animate():' % (
+            default['seconds'] / chosen['seconds'])
+        print '    sstep=%g, kernel=%r, send=%g' % (chosen['sstep'], chosen['kernel'], args.send)
+
+    if args.output:
+        f = open(args.output, 'w')
+        json.dump({'scene': args.scene, 'target': args.target,
+                   'btol': args.target if args.btol is None else args.btol,
+                   'at': args.at, 'send': args.send,
+                   'reference': {'segments': ref['segments'], 'scale': ref['scale'],
+                                 'converged': ref['converged'], 'change': ref['change'],
+                                 'seconds': ref['seconds']},
+                   'tried': tried, 'chosen': chosen, 'default': default},
+                  f, indent=1, sort_keys=True)
+        f.close()
@@ -0,0 +1,177 @@
+'''
+Fast path for coaxial circular loops and solenoids.
+
+The field of a circular loop has a closed form in terms of the
+complete elliptic integrals K and E, so a coil of coaxial loops
+costs one evaluation per loop instead of a sum over the many
+straight segments that approximate it.  A solenoid is taken as
+evenly spaced coaxial loops (leaving out the small current along
+the axis of a real helix).
+
+In a plane through the axis, the field lines are the contours of
+the flux function r A_phi, so they're drawn as contours instead of
+being traced step by step.  Running this file draws Hong's solenoid
+that way:
+
+    python axisym.py [out.png]
+'''
+
+from segments import BLOCK
+import math
+import numpy
+import sys
+import time
+
+# Axis names
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+def ellipke(m):
+    '''Complete elliptic integrals K(m) and E(m) of the parameter m
+    (the modulus squared), by the arithmetic-geometric mean.
+    '''
+    m = numpy.asarray(m, dtype=float)
+    a = numpy.ones(m.shape)
+    b = numpy.sqrt(1 - m)
+    c2 = m.copy()
+    total = c2 / 2
+    power = .5
+    for i in range(40):
+        c = (a - b) / 2
+        a, b = (a + b) / 2, numpy.sqrt(a * b)
+        power *= 2
+        total += power * c * c
+        if (abs(c) <= 1e-16 * a).all():
+            break
+    K = math.pi / (2 * a)
+    return K, K * (1 - total)
+
+class Coil(object):
+    '''Coaxial circular loops, on the axis through center.
+    Has the same field() as Segments, so it can be used in its place.
+    radius - radius of each loop
+    position - where along the axis each loop is (from center)
+    current - current of each loop (or one for all of them)
+    k - constant in front of Biot-Savart, mu0 / (4 pi)
+    '''
+
+    def __init__(self, radius, position, current=1, k=1, axis='z', center=(0, 0, 0)):
+        self.radius = numpy.asarray(radius, dtype=float).reshape(-1)
+        self.position = numpy.asarray(position, dtype=float).reshape(-1)
+        self.current = numpy.ones(len(self.radius)) * current
+        self.k = k
+        self.axis = numpy.identity(3)[AXES[axis]]
+        self.center = numpy.asarray(center, dtype=float)
+
+    def __len__(self):
+        return len(self.radius)
+
+    def terms(self, r, z):
+        '''What the field of each loop needs at the points (r, z),
+        each of shape (points, loops): the loop radius a, the offset dz
+        along the axis, s = a^2 + r^2 + dz^2, alpha^2, beta, m, K and E.
+        '''
+        a = self.radius[None, :]
+        dz = z[:, None] - self.position[None, :]
+        r = r[:, None]
+        s = a * a + r * r + dz * dz
+        alpha2 = s - 2 * a * r
+        beta2 = s + 2 * a * r
+        m = 1 - alpha2 / numpy.where(beta2 > 0, beta2, 1)
+        K, E = ellipke(numpy.clip(m, 0, 1 - 1e-16))
+        return a, dz, s, alpha2, numpy.sqrt(beta2), m, K, E
+
+    def blocks(self, r, z):
+        '''Splits the points (r, z) into blocks of at most BLOCK
+        (point, loop) pairs.  Yields the slice of each block.
+        '''
+        step = max(1, BLOCK // max(len(self), 1))
+        for i in range(0, len(r), step):
+            yield slice(i, i + step)
+
+    def cylindrical(self, r, z):
+        '''Radial and axial field at distances r from the axis and z
+        along it, as (b_r, b_z).  On a loop the field is left as 0.
+        '''
+        r, z = [x.reshape(-1) for x in numpy.broadcast_arrays(numpy.asarray(r, dtype=float),
+                                                              numpy.asarray(z, dtype=float))]
+        br = numpy.zeros(len(r))
+        bz = numpy.zeros(len(r))
+        for b in self.blocks(r, z):
+            a, dz, s, alpha2, beta, m, K, E = self.terms(r[b], z[b])
+            ok = alpha2 > 0
+            c = numpy.where(ok, 2 * self.k * self.current / numpy.where(ok, alpha2 * beta, 1), 0)
+            bz[b] = (c * ((a * a - r[b, None] ** 2 - dz * dz) * E + alpha2 * K)).sum(axis=1)
+            # b_r is 0 on the axis.
+            rb = r[b, None]
+            c = numpy.where(rb > 0, c * dz / numpy.where(rb > 0, rb, 1), 0)
+            br[b] = (c * (s * E - alpha2 * K)).sum(axis=1)
+        return br, bz
+
+    def flux(self, r, z):
+        '''Flux function r A_phi at (r, z); its contours are field lines.'''
+        shape = numpy.broadcast(numpy.asarray(r), numpy.asarray(z)).shape
+        r, z = [x.reshape(-1) for x in numpy.broadcast_arrays(numpy.asarray(r, dtype=float),
+                                                              numpy.asarray(z, dtype=float))]
+        psi = numpy.zeros(len(r))
+        for b in self.blocks(r, z):
+            a, dz, s, alpha2, beta, m, K, E = self.terms(r[b], z[b])
+            # A_phi = 4 k I / sqrt(m) sqrt(a / r) ((1 - m / 2) K - E)
+            ok = (m > 0) & (alpha2 > 0)
+            q = numpy.sqrt(numpy.where(ok, m, 1))
+            psi[b] = numpy.where(ok, 4 * self.k * self.current * numpy.sqrt(a * r[b, None]) / q
+                                 * ((1 - m / 2) * K - E), 0).sum(axis=1)
+        return psi.reshape(shape)
+
+    def field(self, points):
+        '''Magnetic field at each of the points, shape (m, 3).'''
+        points = numpy.asarray(points, dtype=float).reshape(-1, 3) - self.center
+        z = points.dot(self.axis)
+        radial = points - z[:, None] * self.axis
+        r = numpy.sqrt((radial ** 2).sum(axis=1))
+        br, bz = self.cylindrical(r, z)
+        safe = r > 0
+        radial[safe] /= r[safe, None]
+        return br[:, None] * radial + bz[:, None] * self.axis
+
+def loop(radius, current=1, k=1, axis='z', center=(0, 0, 0)):
+    '''A single circular loop.'''
+    return Coil([radius], [0], current, k, axis, center)
+
+def solenoid(radius, length, turns, current=1, k=1, axis='z', center=(0, 0, 0)):
+    '''A solenoid as turns coaxial loops, evenly spaced over length
+    and centered on center.
+    '''
+    position = (numpy.arange(turns) - (turns - 1) / 2.) * length / turns
+    return Coil(numpy.ones(turns) * radius, position, current, k, axis, center)
+
+def contours(coil, zlim, rmax, n=400, levels=30, out='axisym.png'):
+    '''Draws the field lines of the coil in a plane through its axis
+    as contours of the flux function, and saves them to out.
+    zlim - (low, high) range along the axis
+    rmax - distance from the axis to draw out to (on both sides)
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot
+
+    z, r = numpy.meshgrid(numpy.linspace(zlim[0], zlim[1], n), numpy.linspace(-rmax, rmax, n))
+    psi = coil.flux(abs(r), z)
+
+    # Evenly spaced flux levels give the line density of the field.
+    top = numpy.percentile(psi, 99)
+    figure = pyplot.figure(figsize=(8, 8 * rmax / float(zlim[1] - zlim[0]) + 1))
+    pyplot.contour(z, r, psi, numpy.linspace(0, top, levels + 1)[1:], colors='k', linewidths=.6)
+    for side in (1, -1):
+        pyplot.plot(coil.position, side * coil.radius, 'o', color=(.72, .45, .2), markersize=2)
+    pyplot.gca().set_aspect('equal')
+    pyplot.savefig(out, dpi=100)
+    pyplot.close(figure)
+
+if __name__ == "__main__":
+    out = sys.argv[1] if len(sys.argv) > 1 else 'axisym.png'
+
+    # Hong's solenoid: radius 100, 200 turns, 25 apart, current 100.
+    coil = solenoid(100, 5000, 200, 100, axis='x')
+    stime = time.time()
+    contours(coil, (-3000, 3000), 600, out=out)
+    print('%d loops, %.2fs -> %s' % (len(coil), time.time() - stime, out))
@@ -0,0 +1,172 @@
+'''
+Samples the field once on a 3D grid, so field lines can be traced
+through interpolated values instead of the full Biot-Savart sum.
+
+The grid covers the wires' bounding box (plus some padding) with
+cubic cells.  Inside a cell the field is interpolated trilinearly
+from its 8 corners.  Cells within a set distance of a wire, where
+the field changes too quickly to interpolate, and points outside
+the grid fall back to the exact sum.
+
+UnitFields keeps the field of each wire at unit current on one grid,
+so when only the currents change, the grid for the new currents is a
+sum of the samples, without any Biot-Savart sum.
+'''
+
+from segments import BLOCK
+import copy
+import numpy
+
+def box(segs, n=32, pad=.25):
+    '''Corner, cell size and number of nodes along each side of the
+    grid around segs, see FieldGrid.
+    '''
+    ends = numpy.concatenate([segs.start, segs.end])
+    lo = ends.min(axis=0)
+    hi = ends.max(axis=0)
+    size = (hi - lo).max()
+    lo = lo - pad * size
+    hi = hi + pad * size
+    h = (hi - lo).max() / (n - 1)
+    return lo, h, numpy.maximum(numpy.ceil((hi - lo) / h).astype(int) + 1, 2)
+
+def clearance(segs, points):
+    '''Lower bound on the distance from each of the points to the
+    nearest segment: its distance to the segment's midpoint less half
+    the segment's length.
+    '''
+    half = numpy.sqrt((segs.dl ** 2).sum(axis=1)) / 2
+    out = numpy.empty(len(points))
+    step = max(1, BLOCK // max(len(segs), 1))
+    for i in range(0, len(points), step):
+        d = points[i:i + step, None, :] - segs.mid[None, :, :]
+        out[i:i + step] = (numpy.sqrt(numpy.einsum('ijk,ijk->ij', d, d)) - half).min(axis=1)
+    return out
+
+def estimate(segs, points, n=32, pad=.25, near=None):
+    '''What a grid around segs would cost and save, without building it:
+    its number of nodes (about the field evaluations it takes to build)
+    and the fraction of the points that are in cells away from the
+    wires, where it interpolates instead of summing.  Only points at
+    least a cell diagonal further than near from every segment count,
+    since they can't have a close corner, so the fraction is a low
+    estimate.
+    '''
+    lo, h, shape = box(segs, n, pad)
+    if near is None:
+        near = 1.5 * h
+    points = numpy.asarray(points, dtype=float).reshape(-1, 3)
+    inside = ((points >= lo) & (points <= lo + (shape - 1) * h)).all(axis=1)
+    far = inside & (clearance(segs, points) > near + 3 ** .5 * h)
+    return int(numpy.prod(shape)), far.mean() if len(points) else 0.
+
+class FieldGrid(object):
+    '''Field sampled on a grid around a set of segments.
+    Has the same field() as Segments, so it can be used in its place.
+    segs - the Segments giving the geometry (and field, unless source)
+    n - number of nodes along the longest side of the box
+    pad - padding around the wires, as a fraction of the box size
+    near - cells closer than this to a wire use the exact sum
+           (by default one and a half cells)
+    source - what to sample and fall back to, if not segs
+             (like an octree.Tree)
+    sample - whether to sample source now, or leave b to be set
+    '''
+
+    def __init__(self, segs, n=32, pad=.25, near=None, source=None, sample=True):
+        self.segs = segs
+        self.source = source or segs
+
+        # Box around the wires, with cubic cells
+        self.lo, self.h, self.shape = box(segs, n, pad)
+        if near is None:
+            near = 1.5 * self.h
+        self.near = near
+
+        nodes = numpy.indices(self.shape).reshape(3, -1).T * self.h + self.lo
+
+        # Nodes close to a wire
+        close = (clearance(segs, nodes) < near).reshape(self.shape)
+
+        # A cell is close if any of its corners is, so the field
+        # at close nodes is never needed.
+        self.close = numpy.zeros(self.shape - 1, dtype=bool)
+        for c in self.corners():
+            self.close |= close[c[0]:self.shape[0] - 1 + c[0],
+                                c[1]:self.shape[1] - 1 + c[1],
+                                c[2]:self.shape[2] - 1 + c[2]]
+
+        self.far = ~close.reshape(-1)
+        self.samples = int(self.far.sum())
+        self.b = None
+        if sample:
+            self.b = self.sample(self.source)
+
+    def __len__(self):
+        return len(self.segs)
+
+    def sample(self, source):
+        '''Field of source at the nodes away from the wires,
+        shape (the grid's shape) + (3,).
+        '''
+        nodes = numpy.indices(self.shape).reshape(3, -1).T * self.h + self.lo
+        b = numpy.zeros(tuple(self.shape) + (3,))
+        b.reshape(-1, 3)[self.far] = source.field(nodes[self.far])
+        return b
+
+    @staticmethod
+    def corners():
+        '''Offsets of the 8 corners of a cell.'''
+        return [(i, j, k) for i in (0, 1) for j in (0, 1) for k in (0, 1)]
+
+    def field(self, points):
+        '''Magnetic field at each of the points, shape (m, 3).'''
+        points = numpy.asarray(points, dtype=float).reshape(-1, 3)
+        b = numpy.empty(points.shape)
+
+        # Cell of each point, and where in the cell it is
+        u = (points - self.lo) / self.h
+        i = numpy.floor(u).astype(int)
+        ok = ((i >= 0) & (i < self.shape - 1)).all(axis=1)
+        ok[ok] = ~self.close[i[ok, 0], i[ok, 1], i[ok, 2]]
+
+        # Trilinear interpolation in the cells away from the wires
+        i = i[ok]
+        f = u[ok] - i
+        g = 1 - f
+        bi = numpy.zeros((len(i), 3))
+        for c in self.corners():
+            w = numpy.where(c[0], f[:, 0], g[:, 0]) * numpy.where(c[1], f[:, 1], g[:, 1]) \
+                * numpy.where(c[2], f[:, 2], g[:, 2])
+            bi += w[:, None] * self.b[i[:, 0] + c[0], i[:, 1] + c[1], i[:, 2] + c[2]]
+        b[ok] = bi
+
+        # Exact sum everywhere else
+        if not ok.all():
+            b[~ok] = self.source.field(points[~ok])
+        return b
+
+class UnitFields(object):
+    '''The field of each of several wires at unit current,
+    sampled on one grid.
+    segs - all the wires' segments, which the grid is laid out around
+    units - a source (like a Segments) for each wire at unit current
+    n, pad, near - as for FieldGrid
+    '''
+
+    def __init__(self, segs, units, n=32, pad=.25, near=None):
+        self.grid = FieldGrid(segs, n, pad, near, sample=False)
+        self.b = [self.grid.sample(unit) for unit in units]
+
+    def combine(self, currents, source):
+        '''FieldGrid of the wires at the given currents, one per wire.
+        source - the wires at these currents, for the cells near
+                 them and outside the grid
+        '''
+        grid = copy.copy(self.grid)
+        grid.b = numpy.zeros(self.b[0].shape) if self.b else None
+        for current, b in zip(currents, self.b):
+            if current:
+                grid.b += current * b
+        grid.source = source
+        return grid
@@ -0,0 +1,140 @@
+'''
+Evaluates the field at very many points in bounded memory.
+
+The points can be an array (memory-mapped or not), a Lattice, or any
+iterable of points or of arrays of points, so a million point slice
+through a volume never has to be in memory at once.  They're taken a
+tile at a time, with the tile sized to a memory budget, and the field
+of each tile is written straight into the output, which can be a .npy
+file on disk.  Segments.field() itself never works on more than
+segments.BLOCK (point, segment) pairs at once, so memory stays the
+same however many points or segments there are.
+
+Running this file maps the field of a long solenoid (summed with
+an octree) on a plane through its axis:
+
+    python fieldmap.py [out.npy] [n]
+'''
+
+from segments import BLOCK
+import math
+import numpy
+import sys
+import time
+
+# Working memory for one tile, in bytes
+BUDGET = 64 << 20
+
+# Bytes used per point of a tile: the point and its field,
+# with a few temporary copies of each.  A source that uses more
+# (like an octree) says so with its own point_bytes.
+POINT_BYTES = 4 * 2 * 3 * 8
+
+class Lattice(object):
+    '''Regular grid of points from lo to hi with shape points along
+    each axis, made a slice at a time instead of held in memory.
+    Points go in C order (the last axis fastest), like numpy.indices.
+    '''
+
+    def __init__(self, lo, hi, shape):
+        self.lo = numpy.asarray(lo, dtype=float)
+        self.hi = numpy.asarray(hi, dtype=float)
+        self.shape = tuple(shape)
+        self.h = (self.hi - self.lo) / numpy.maximum(numpy.array(self.shape) - 1, 1)
+
+    def __len__(self):
+        return int(numpy.prod(self.shape))
+
+    def __getitem__(self, s):
+        '''Points s (a slice) of the grid, shape (m, 3).'''
+        i = numpy.arange(*s.indices(len(self)))
+        return numpy.array(numpy.unravel_index(i, self.shape)).T * self.h + self.lo
+
+def tiles(points, size):
+    '''Splits the points into arrays of at most size points.'''
+    if hasattr(points, '__getitem__') and hasattr(points, '__len__'):
+        for i in range(0, len(points), size):
+            yield numpy.asarray(points[i:i + size], dtype=float).reshape(-1, 3)
+        return
+
+    # Any other iterable, of points or of arrays of points
+    tile = []
+    count = 0
+    for p in points:
+        p = numpy.asarray(p, dtype=float).reshape(-1, 3)
+        tile.append(p)
+        count += len(p)
+        while count >= size:
+            p = numpy.concatenate(tile)
+            yield p[:size]
+            tile = [p[size:]]
+            count = len(tile[0])
+    if count:
+        yield numpy.concatenate(tile)
+
+def tile_size(source, budget=BUDGET):
+    '''Number of points to evaluate at once within the budget.'''
+    # Leave room for the blocks of the sum itself.
+    return max(1, (budget - BLOCK * 8 * 8) // getattr(source, 'point_bytes', POINT_BYTES))
+
+def evaluate(source, points, out=None, count=None, budget=BUDGET, dtype='<f8'):
+    '''Field of source at each of the points, written a tile at a time.
+    source - anything with field(points), like a Segments or octree.Tree
+    points - (m, 3) array, Lattice, or iterable of points (or arrays of them)
+    out - where to put the field: None for a new array, the name of
+          a .npy file to write, or an (m, 3) array to fill in
+    count - number of points, for a file when points has no len()
+    budget - working memory in bytes, see tile_size()
+    Returns the field, shape (m, 3) (memory-mapped for a file).
+    '''
+    if count is None and hasattr(points, '__len__'):
+        count = len(points)
+
+    if isinstance(out, str):
+        if count is None:
+            raise ValueError('count is needed to write the field of an iterable to a file')
+        out = numpy.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=(count, 3))
+
+    size = tile_size(source, budget)
+    if out is None and count is None:
+        # No way to know the size up front, so it has to be collected.
+        return numpy.concatenate([source.field(p) for p in tiles(points, size)] or
+                                 [numpy.zeros((0, 3))]).astype(dtype)
+    if out is None:
+        out = numpy.empty((count, 3), dtype=dtype)
+
+    i = 0
+    for p in tiles(points, size):
+        if i + len(p) > len(out):
+            raise ValueError('more points than the output holds')
+        out[i:i + len(p)] = source.field(p)
+        i += len(p)
+    if i != len(out):
+        raise ValueError('%d points for an output of %d' % (i, len(out)))
+
+    if hasattr(out, 'flush'):
+        out.flush()
+    return out
+
+if __name__ == "__main__":
+    from segments import Segments
+    import octree
+    import resource
+
+    name = sys.argv[1] if len(sys.argv) > 1 else 'fieldmap.npy'
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    # Long solenoid: 100 turns of radius 1, 10 units long.
+    t = numpy.linspace(0, 100 * 2 * math.pi, 20001)
+    coil = numpy.array([t / (20 * math.pi) - 5, numpy.cos(t), numpy.sin(t)]).T
+    segs = Segments(coil[:-1], coil[1:])
+    tree = octree.Tree(segs)
+
+    # n by n points on the plane z = 0
+    plane = Lattice((-8, -4, 0), (8, 4, 0), (n, n, 1))
+    stime = time.time()
+    b = evaluate(tree, plane, name)
+    elapsed = time.time() - stime
+    print('%d points, %d segments: %.1fs, %.3g points/s, peak memory %.0f MB' % (
+        len(plane), len(segs), elapsed, len(plane) / elapsed,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.))
@@ -0,0 +1,242 @@
+'''
+Reads and writes the frame files made by animate().
+
+A frame is the wires and field lines of one moment in time.
+The binary format stores them as flat arrays, so they can be
+memory-mapped instead of unpickled:
+
+    magic        'BFRM' + version (uint32)
+    header size  uint32
+    header       JSON, {name: [dtype, shape, offset]} for each array
+    arrays       raw little-endian data, 8 byte aligned
+
+wire_points holds every wire point (x, y, z) one after another, and
+wire_offsets[i]:wire_offsets[i + 1] are the rows of wire i.
+line_points and line_offsets do the same for the field lines,
+with a fourth column for the magnitude of b.
+
+A frame written with simplify also has line_detail, the Douglas-Peucker
+detail of each line point (see detail()).  Points of less detail than
+the tolerance are left out of the file, and a reader can leave out
+more by asking for a bigger tolerance, e.g. for a distant view.
+
+Files are written under a temporary name and renamed when done, and
+complete() checks a file is whole, so an interrupted run never leaves
+a partial frame that looks finished.
+
+Frames written by older versions are text pickles of [wires, lines]
+and can still be read, or converted by running this file:
+
+    python frames.py line_0000.txt line_0001.txt ...
+'''
+
+import glob
+import json
+import numpy
+import os
+import pickle
+import struct
+import sys
+
+MAGIC = 'BFRM'
+VERSION = 1
+
+# Extension of binary frame files
+EXT = '.dat'
+
+def flatten(items, columns, dtype):
+    '''Packs a list of point lists into (offsets, points).'''
+    offsets = numpy.zeros(len(items) + 1, dtype='<i8')
+    arrays = []
+    for i, item in enumerate(items):
+        item = numpy.asarray(item, dtype=dtype).reshape(-1, columns)
+        offsets[i + 1] = offsets[i] + len(item)
+        arrays.append(item)
+
+    if arrays:
+        points = numpy.concatenate(arrays)
+    else:
+        points = numpy.zeros((0, columns), dtype=dtype)
+    return offsets, points
+
+def detail(line):
+    '''Douglas-Peucker detail of each point of a line: the largest
+    tolerance that simplifying the line to keeps the point at.
+    The ends are always kept.  Simplifying to a tolerance keeps the
+    points of more detail than it, and every point kept at one
+    tolerance is kept at all smaller ones.
+    '''
+    p = numpy.asarray(line, dtype=float)
+    p = p.reshape(len(p), -1)[:, :3]
+    d = numpy.zeros(len(p))
+    if len(p) == 0:
+        return d
+    d[0] = d[-1] = numpy.inf
+
+    # Split at the point furthest from the chord between the ends,
+    # and the same for each side; a point is never kept when the
+    # split that found it wasn't.
+    stack = [(0, len(p) - 1, numpy.inf)]
+    while stack:
+        i, j, limit = stack.pop()
+        if j - i < 2:
+            continue
+        chord = p[j] - p[i]
+        q = p[i + 1:j] - p[i]
+        length = chord.dot(chord)
+        if length > 0:
+            t = numpy.clip(q.dot(chord) / length, 0, 1)
+            q = q - t[:, None] * chord
+        dist = numpy.sqrt((q ** 2).sum(axis=1))
+        m = dist.argmax()
+        d[i + 1 + m] = min(dist[m], limit)
+        stack.append((i, i + 1 + m, d[i + 1 + m]))
+        stack.append((i + 1 + m, j, d[i + 1 + m]))
+    return d
+
+def write(name, w, l, dtype='<f8', simplify=None):
+    '''Writes the wires w and field lines l into a binary frame file.
+    simplify - if given, leave out the line points of this much detail
+               or less, and store the detail of the rest (see detail())
+    '''
+    details = None
+    if simplify is not None:
+        lines = []
+        details = []
+        for line in l:
+            line = numpy.asarray(line, dtype=float).reshape(-1, 4)
+            d = detail(line)
+            keep = d > simplify
+            lines.append(line[keep])
+            details.append(d[keep])
+        l = lines
+
+    wire_offsets, wire_points = flatten(w, 3, dtype)
+    line_offsets, line_points = flatten(l, 4, dtype)
+    arrays = [('wire_offsets', wire_offsets),
+              ('wire_points', wire_points),
+              ('line_offsets', line_offsets),
+              ('line_points', line_points)]
+    if details is not None:
+        arrays.append(('line_detail', flatten(details, 1, '<f4')[1].reshape(-1)))
+
+    # Lay the arrays out after the header, 8 byte aligned.
+    # The header holds its own offsets, so size it with a
+    # generous guess and pad it out.
+    start = 4096
+    header = {}
+    offset = start
+    for key, a in arrays:
+        header[key] = [a.dtype.str, list(a.shape), offset]
+        offset += (a.nbytes + 7) // 8 * 8
+    text = json.dumps(header, sort_keys=True)
+    if len(text) + 12 > start:
+        raise ValueError('frame header too large')
+
+    part = '%s.%d.part' % (name, os.getpid())
+    f = open(part, 'wb')
+    f.write(MAGIC)
+    f.write(struct.pack('<II', VERSION, len(text)))
+    f.write(text)
+    for key, a in arrays:
+        f.seek(header[key][2])
+        f.write(a.tobytes())
+    # Pad the file out to the end of the last array.
+    f.truncate(offset)
+    f.close()
+
+    # Windows can't rename over an existing file.
+    if os.name == 'nt' and os.path.exists(name):
+        os.remove(name)
+    os.rename(part, name)
+
+def isbinary(name):
+    '''Whether the file is a binary frame.'''
+    f = open(name, 'rb')
+    magic = f.read(len(MAGIC))
+    f.close()
+    return magic == MAGIC
+
+def read_binary(name):
+    '''Memory-maps a binary frame.
+    Returns a dict of the arrays in the file.
+    '''
+    m = numpy.memmap(name, dtype='u1', mode='r')
+    version, size = struct.unpack('<II', m[4:12].tobytes())
+    if version > VERSION:
+        raise ValueError('%s: unknown frame version %d' % (name, version))
+    header = json.loads(m[12:12 + size].tobytes())
+
+    arrays = {}
+    for key, (dtype, shape, offset) in header.items():
+        dtype = numpy.dtype(str(dtype))
+        nbytes = dtype.itemsize * int(numpy.prod(shape))
+        if offset + nbytes > len(m):
+            raise ValueError('%s: frame is truncated' % name)
+        arrays[key] = m[offset:offset + nbytes].view(dtype).reshape(shape)
+    return arrays
+
+def complete(name):
+    '''Whether name is a whole binary frame, not missing or cut short.'''
+    try:
+        if not isbinary(name):
+            return False
+        read_binary(name)
+        return True
+    except (IOError, OSError, ValueError, struct.error):
+        return False
+
+def split_points(offsets, points):
+    '''Splits flat points back into a list of arrays (views, not copies).'''
+    return [points[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+def read_pickle(name):
+    '''Loads a text pickle frame from an older version.'''
+    f = open(name, 'rb')
+    data = f.read()
+    f.close()
+
+    # Protocol 0 pickles written in text mode on Windows have \r\n
+    # line endings.  All other bytes are escaped, so this is safe.
+    return pickle.loads(data.replace('\r\n', '\n'))
+
+def read(name, tol=None):
+    '''Loads a frame in either format.
+    Returns (wires, fieldlines) as lists of arrays with
+    rows of (x, y, z) and (x, y, z, b) respectively.
+    tol - if given, simplify the field lines to this tolerance,
+          using the stored detail if the frame has it
+    '''
+    if isbinary(name):
+        a = read_binary(name)
+        w = split_points(a['wire_offsets'], a['wire_points'])
+        l = split_points(a['line_offsets'], a['line_points'])
+        if tol is not None and 'line_detail' in a:
+            d = split_points(a['line_offsets'], a['line_detail'])
+            return w, [line[ld > tol] for line, ld in zip(l, d)]
+    else:
+        w, l = read_pickle(name)
+        w = [numpy.asarray(wire, dtype=float).reshape(-1, 3) for wire in w]
+        l = [numpy.asarray(line, dtype=float).reshape(-1, 4) for line in l]
+
+    if tol is not None:
+        l = [line[detail(line) > tol] for line in l]
+    return w, l
+
+def convert(name, out=None):
+    '''Converts a pickle frame into a binary frame.
+    Returns the name of the new file.
+    '''
+    if out is None:
+        out = os.path.splitext(name)[0] + EXT
+    w, l = read_pickle(name)
+    write(out, w, l)
+    return out
+
+if __name__ == "__main__":
+    # Convert the given files, or every old frame in this folder.
+    names = sys.argv[1:] or sorted(glob.glob('*[0-9][0-9][0-9][0-9].txt'))
+    for name in names:
+        if isbinary(name):
+            continue
+        print name, '->', convert(name)
@@ -0,0 +1,36 @@
+'''
+Errors of field lines and fields against a reference, shared by the
+accuracy scripts (B-tune.py, B-precision.py).
+'''
+
+from segments import BLOCK
+import numpy
+
+def distance(points, line):
+    '''Distance from each of the points to the polyline line.'''
+    points = numpy.asarray(points, dtype=float)[:, :3]
+    line = numpy.asarray(line, dtype=float)[:, :3]
+    if len(line) < 2:
+        return numpy.sqrt(((points - line[0]) ** 2).sum(axis=1))
+    a = line[:-1]
+    d = line[1:] - a
+    l2 = numpy.maximum((d ** 2).sum(axis=1), 1e-300)
+    out = numpy.empty(len(points))
+    step = max(1, BLOCK // len(a))
+    for i in range(0, len(points), step):
+        r = points[i:i + step, None, :] - a[None, :, :]
+        u = numpy.clip((r * d).sum(axis=2) / l2, 0, 1)
+        e = r - u[:, :, None] * d
+        out[i:i + step] = numpy.sqrt((e ** 2).sum(axis=2)).min(axis=1)
+    return out
+
+def line_error(lines, ref):
+    '''Largest distance of any point of the lines from its reference line.'''
+    return max([distance(line, r).max() for line, r in zip(lines, ref)] or [0])
+
+def field_error(segs, points, b):
+    '''Largest error of the field of segs at the points, relative to
+    the reference field b there.
+    '''
+    e = numpy.sqrt(((segs.field(points) - b) ** 2).sum(axis=1))
+    return (e / numpy.maximum(numpy.sqrt((b ** 2).sum(axis=1)), 1e-300)).max()
@@ -0,0 +1,222 @@
+'''
+Hierarchical (Barnes-Hut) evaluation of the Biot-Savart sum.
+
+The segments are grouped in an octree.  A group that is far enough
+from a point, compared with its size, and whose error there is small
+enough, is treated as one aggregate current element (with first and
+second order corrections for how the current is spread out inside
+it).  Everything closer is summed exactly.
+
+Walking the tree costs a lot more per group than the direct sum does
+per segment, so for few points or segments the tree is slower.  After
+its first walk it predicts the cost of the next one, and sums directly
+when that's cheaper.
+
+Running this file compares the tree against the direct sum for a
+long solenoid and prints the accuracy and speed for a few opening
+angles:
+
+    python octree.py [segments] [points]
+'''
+
+from segments import Segments
+import math
+import numpy
+import sys
+import time
+
+# Cost of walking the tree, in (point, segment) pairs of the direct
+# sum: for each group visited, and for each point it's visited with,
+# as measured on the solenoid below
+VISIT_COST = 16000
+POINT_COST = 32
+
+class Node(object):
+    '''A group of segments in the octree.
+    center - where the group's current is centered
+    radius - distance from center to the furthest segment end
+    q - total current element, sum of c * dl, c being k * current
+        of each segment
+    s - sum of |c * dl|, to bound the error of using the group
+    a - sum of c * dl x d, d being each midpoint relative to center
+    m - sum of d c * dl^T (3 by 3)
+    A - sum of (c * dl x d) d^T (3 by 3)
+    T - sum of d d^T c * dl, T[a, b, j] (3 by 3 by 3), with the
+        spread of each segment along itself for the exact kernel
+    children - sub groups, or None for a leaf
+    segs - the segments of a leaf, summed exactly (in their dtype)
+    '''
+
+    def __init__(self, start, end, c, leaf, kernel='midpoint', dtype=numpy.float64):
+        mid = (start + end) / 2
+        q = c[:, None] * (end - start)
+
+        # Center the group on its current, falling back to the midpoints.
+        weight = numpy.sqrt((q ** 2).sum(axis=1))
+        if weight.sum() > 0:
+            self.center = (mid * weight[:, None]).sum(axis=0) / weight.sum()
+        else:
+            self.center = mid.mean(axis=0)
+        d = mid - self.center
+        self.radius = math.sqrt(max(((start - self.center) ** 2).sum(axis=1).max(),
+                                    ((end - self.center) ** 2).sum(axis=1).max()))
+
+        # Moments of the current around the center.
+        self.q = q.sum(axis=0)
+        self.s = weight.sum()
+        qd = numpy.cross(q, d)
+        self.a = qd.sum(axis=0)
+        self.m = d.T.dot(q)
+        self.A = qd.T.dot(d)
+        dd = d[:, :, None] * d[:, None, :]
+        if kernel == 'exact':
+            dl = end - start
+            dd += dl[:, :, None] * dl[:, None, :] / 12.
+        self.T = dd.reshape(-1, 9).T.dot(q).reshape(3, 3, 3)
+        self.t = self.T.reshape(9, 3)
+        self.Q2 = self.T[0, 0] + self.T[1, 1] + self.T[2, 2]
+
+        self.children = None
+        self.segs = None
+
+        # Split the group into octants, unless it's small enough.
+        lo = mid.min(axis=0)
+        hi = mid.max(axis=0)
+        if len(mid) > leaf and (hi > lo).any():
+            octant = ((mid > (lo + hi) / 2) * [1, 2, 4]).sum(axis=1)
+            self.children = [Node(start[octant == o], end[octant == o], c[octant == o], leaf, kernel, dtype)
+                             for o in range(8) if (octant == o).any()]
+        else:
+            self.segs = Segments(start, end, c, kernel=kernel, dtype=dtype)
+
+    def approx(self, r, dist):
+        '''Field of the whole group at offsets r from its center,
+        to second order in the size of the group over the distance.
+        '''
+        u = r / dist[:, None]
+        v = u.dot(self.m)
+        b = numpy.cross(self.q, u) * dist[:, None] - self.a + 3 * numpy.cross(v, u)
+        w = (u[:, :, None] * u[:, None, :]).reshape(-1, 9).dot(self.t)
+        b += (-3 * u.dot(self.A.T) - 1.5 * numpy.cross(self.Q2, u) + 7.5 * numpy.cross(w, u)) / dist[:, None]
+        return b / (dist ** 3)[:, None]
+
+class Tree(object):
+    '''Octree over a set of segments.
+    Has the same field() as Segments, so it can be used in its place.
+    theta - opening angle; a group is used as a whole when its
+            radius is less than theta times its distance, and
+    tol - the next order of its expansion there, s radius^3 / dist^5,
+          is less than tol times the field of all the current at the
+          size of the tree (the root's s over its radius squared)
+    leaf - most segments in a group that isn't split further
+    '''
+
+    # Memory used for each point evaluated at once (see fieldmap.py):
+    # the walk keeps index and offset arrays for the nodes on its stack.
+    point_bytes = 512
+
+    def __init__(self, segs, theta=.3, tol=1e-3, leaf=32):
+        self.theta = theta
+        self.tol = tol
+        self.segs = segs
+        self.root = Node(segs.start, segs.end, segs.c, leaf, segs.kernel, segs.dtype)
+        self.n = len(segs)
+        self.scale = self.root.s / max(self.root.radius, 1e-300) ** 2
+        # Groups visited by the last walk, the cost of the rest of it
+        # per point, and whether it was used (or summed directly)
+        self.visits = None
+        self.per_point = None
+        self.walked = False
+
+    def __len__(self):
+        return self.n
+
+    def cost(self, m):
+        '''Predicted cost of a walk with m points, in pairs of the
+        direct sum (None before the first walk).
+        '''
+        if self.visits is None:
+            return None
+        return self.visits * VISIT_COST + self.per_point * m
+
+    def field(self, points):
+        '''Magnetic field at each of the points, shape (m, 3).'''
+        points = numpy.asarray(points, dtype=float).reshape(-1, 3)
+        b = numpy.zeros(points.shape)
+        if self.n == 0:
+            return b
+
+        # The direct sum, when the walk would cost more
+        cost = self.cost(len(points))
+        self.walked = cost is None or cost < self.n * len(points)
+        if not self.walked:
+            return self.segs.field(points)
+
+        # Walk the tree with every point that still needs each node.
+        visits = 0
+        work = 0
+        limit = self.tol * self.scale
+        stack = [(self.root, numpy.arange(len(points)))]
+        while stack:
+            node, idx = stack.pop()
+            visits += 1
+            work += POINT_COST * len(idx)
+            r = points[idx] - node.center
+            dist = numpy.sqrt((r ** 2).sum(axis=1))
+
+            # Far enough away, and accurate enough, to use the group
+            # as a whole
+            far = (node.radius < self.theta * dist) & (node.s * node.radius ** 3 < limit * dist ** 5)
+            if far.any():
+                b[idx[far]] += node.approx(r[far], dist[far])
+
+            near = idx[~far]
+            if not len(near):
+                continue
+            if node.children is None:
+                b[near] += node.segs.field(points[near])
+                work += len(near) * len(node.segs)
+            else:
+                stack.extend((child, near) for child in node.children)
+
+        self.visits = visits
+        self.per_point = work / float(len(points))
+        return b
+
+def report(segs, points, thetas=(.3, .5, .75)):
+    '''Prints the accuracy and speed of the tree against the direct sum.'''
+    stime = time.time()
+    exact = segs.field(points)
+    direct = time.time() - stime
+    # Errors are relative to the rms field over all the points, since
+    # the field itself nearly cancels in places (outside a solenoid).
+    scale = math.sqrt((exact ** 2).sum(axis=1).mean())
+
+    print('%d segments, %d points' % (len(segs), len(points)))
+    print('direct          %8.3fs' % direct)
+    for theta in thetas:
+        stime = time.time()
+        tree = Tree(segs, theta)
+        build = time.time() - stime
+
+        stime = time.time()
+        b = tree.field(points)
+        elapsed = time.time() - stime
+
+        err = numpy.sqrt(((b - exact) ** 2).sum(axis=1)) / scale
+        print('theta %-5g  %8.3fs (+%.3fs build) x%-6.1f max err %.2e  rms err %.2e  %s' % (
+            theta, elapsed, build, direct / elapsed, err.max(), math.sqrt((err ** 2).mean()),
+            'walks' if tree.cost(len(points)) < tree.n * len(points) else 'sums directly next'))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    m = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    # Long solenoid: 100 turns of radius 1, 10 units long.
+    t = numpy.linspace(0, 100 * 2 * math.pi, n + 1)
+    coil = numpy.array([t / (20 * math.pi) - 5, numpy.cos(t), numpy.sin(t)]).T
+    segs = Segments(coil[:-1], coil[1:])
+
+    # Points scattered around (and inside) the coil.
+    points = numpy.random.RandomState(0).uniform(-8, 8, (m, 3)) * [1, .5, .5]
+    report(segs, points)
@@ -0,0 +1,206 @@
+'''
+Wire shapes that build their whole point array at once.
+
+calculate() in B-calculate.py takes these in place of wire spec lists.
+Each makes all of its points, and the start points of its field lines,
+with a few array operations, where split() calls the wire's function
+once for every point.
+
+Any number or point given to a shape can also be a function of the
+animation time at.  The shrinking toroid loop of B-calculate.py is
+
+    Loop(1, center=lambda at: (1 + 5 * max(1 - at, 0), 0, 0), axis='y',
+         offsets=[-.25, -.5, -.75], nlines=2, symmetry=('rotate', 8))
+
+offsets, nlines, valid, symmetry and current mean the same as in
+a wire spec.
+'''
+
+import math
+import numpy
+
+# Axis names
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+def value(p, at):
+    '''p, or p(at) if it's a function.'''
+    if hasattr(p, '__call__'):
+        return p(at)
+    return p
+
+def plane(axis):
+    '''Unit vectors of the plane of the two other axes, in order.'''
+    i, j = [a for a in range(3) if a != AXES[axis]]
+    return numpy.identity(3)[i], numpy.identity(3)[j]
+
+class Shape(object):
+    '''What all the shapes have in common.
+    offsets - distances to offset the field line start points by
+    nlines - number of field line starts along the wire, for each offset
+    valid - whether the wire is active, or a function of at saying so
+    symmetry - copies of the wire, see transforms() in B-calculate.py
+    current - the wire's current, or a function of at giving it
+              (None for the default, I in B-calculate.py)
+    A shape sets params, the numbers (or functions of at) it's built from,
+    and curve(), the points at parameters u going from 0 to 1 along it.
+    '''
+
+    # Whether the wire ends where it started
+    closed = False
+
+    def __init__(self, offsets=[], nlines=5, valid=True, symmetry=None, current=None):
+        self.offsets = offsets
+        self.nlines = nlines
+        self.valid = valid
+        self.symmetry = symmetry
+        self.current = current
+        self.params = {}
+
+    def static(self):
+        '''Whether the wire can't depend on the animation time.'''
+        return not any(hasattr(p, '__call__') for p in list(self.params.values()) + [self.valid])
+
+    def curve(self, u, offset, p):
+        '''Points at the parameters u, moved out by offset, shape (len(u), 3).
+        p - the params at this time
+        '''
+        raise NotImplementedError('%s must define curve()' % type(self).__name__)
+
+    def samples(self, p):
+        '''Parameters of the wire's points.'''
+        return numpy.linspace(0, 1, p['n'] + 1)
+
+    def build(self, at):
+        '''Builds the wire at time at.
+        Returns its points, shape (n, 3), and the start points of its
+        field lines, shape (m, 3), where and in the order split() gives
+        them: every ceil(segments / nlines) points from the start (up to
+        its end), so a shape starts the same field lines as the spec it
+        replaces, and a closed one starts them at both its ends like a
+        spec does.
+        '''
+        if not value(self.valid, at):
+            return numpy.zeros((0, 3)), numpy.zeros((0, 3))
+
+        p = dict((name, value(param, at)) for name, param in self.params.items())
+        samples = self.samples(p)
+        points = self.curve(samples, 0, p)
+        if self.closed:
+            points[-1] = points[0]
+
+        u = samples[:0]
+        if self.nlines:
+            u = samples[::max(int(math.ceil((len(samples) - 1) / float(self.nlines))), 1)]
+        starts = numpy.array([self.curve(u, o, p) for o in self.offsets]).reshape(len(self.offsets), len(u), 3)
+        return points, starts.transpose(1, 0, 2).reshape(-1, 3)
+
+class Line(Shape):
+    '''Straight wire from start to end, in n segments.
+    Field lines start offset from it along normal.
+    '''
+
+    def __init__(self, start, end, n=100, normal=(0, 1, 0), **options):
+        Shape.__init__(self, **options)
+        self.params = {'start': start, 'end': end, 'n': n, 'normal': normal}
+
+    def curve(self, u, offset, p):
+        start = numpy.asarray(p['start'], dtype=float)
+        end = numpy.asarray(p['end'], dtype=float)
+        return start + u[:, None] * (end - start) + offset * numpy.asarray(p['normal'], dtype=float)
+
+class Polyline(Shape):
+    '''Wire through a list of vertices, each edge cut into pieces no
+    longer than step (if given).  Field lines start evenly spaced along
+    it, offset along normal.
+    '''
+
+    def __init__(self, vertices, step=None, normal=(0, 0, 1), closed=False, **options):
+        Shape.__init__(self, **options)
+        self.params = {'vertices': vertices, 'step': step, 'normal': normal}
+        self.closed = closed
+
+    def lengths(self, p):
+        '''Vertices (closed up if need be) and the distance along the wire to each.'''
+        v = numpy.asarray(p['vertices'], dtype=float).reshape(-1, 3)
+        if self.closed:
+            v = numpy.concatenate([v, v[:1]])
+        d = numpy.sqrt(((v[1:] - v[:-1]) ** 2).sum(axis=1))
+        return v, numpy.concatenate([[0], numpy.cumsum(d)])
+
+    def samples(self, p):
+        v, s = self.lengths(p)
+        if not p['step']:
+            return s / s[-1]
+        # Each edge in equal pieces, keeping the corners
+        pieces = numpy.maximum(numpy.ceil((s[1:] - s[:-1]) / p['step']), 1).astype(int)
+        u = [numpy.linspace(a, b, m, endpoint=False) for a, b, m in zip(s[:-1], s[1:], pieces)]
+        return numpy.concatenate(u + [s[-1:]]) / s[-1]
+
+    def curve(self, u, offset, p):
+        v, s = self.lengths(p)
+        u = u * s[-1]
+        points = numpy.array([numpy.interp(u, s, v[:, i]) for i in range(3)]).T
+        return points + offset * numpy.asarray(p['normal'], dtype=float)
+
+class Loop(Shape):
+    '''Circular loop of the given radius in n segments, around center
+    in the plane of the other two axes than axis, (y, z), (x, z) or (x, y).
+    Field lines start on loops offset bigger.
+    '''
+
+    closed = True
+
+    def __init__(self, radius, center=(0, 0, 0), axis='z', n=60, **options):
+        Shape.__init__(self, **options)
+        self.params = {'radius': radius, 'center': center, 'n': n}
+        self.axis = axis
+
+    def curve(self, u, offset, p):
+        e1, e2 = plane(self.axis)
+        t = 2 * math.pi * u[:, None]
+        return numpy.asarray(p['center'], dtype=float) \
+            + (p['radius'] + offset) * (numpy.cos(t) * e1 + numpy.sin(t) * e2)
+
+class Helix(Shape):
+    '''Solenoid winding along axis from start: turns turns of the given
+    radius, pitch apart, with n segments per turn.
+    Field lines start on helixes offset bigger.
+    '''
+
+    def __init__(self, radius, pitch, turns, start=(0, 0, 0), axis='x', n=50, **options):
+        Shape.__init__(self, **options)
+        self.params = {'radius': radius, 'pitch': pitch, 'turns': turns, 'start': start, 'n': n}
+        self.axis = axis
+
+    def samples(self, p):
+        return numpy.linspace(0, 1, int(math.ceil(p['turns'] * p['n'])) + 1)
+
+    def curve(self, u, offset, p):
+        e1, e2 = plane(self.axis)
+        t = 2 * math.pi * p['turns'] * u[:, None]
+        along = numpy.identity(3)[AXES[self.axis]] * p['pitch'] * p['turns'] * u[:, None]
+        return numpy.asarray(p['start'], dtype=float) + along \
+            + (p['radius'] + offset) * (numpy.cos(t) * e1 + numpy.sin(t) * e2)
+
+class Toroidal(Shape):
+    '''Winding on a torus around the z axis through center: turns turns
+    of the given minor radius around a circle of the major radius, with
+    n segments per turn.  Field lines start on windings of a minor
+    radius offset bigger.
+    '''
+
+    def __init__(self, major, minor, turns, center=(0, 0, 0), n=30, **options):
+        Shape.__init__(self, **options)
+        self.params = {'major': major, 'minor': minor, 'turns': turns, 'center': center, 'n': n}
+        # A whole number of turns comes back to the start.
+        self.closed = turns == int(turns) if not hasattr(turns, '__call__') else False
+
+    def samples(self, p):
+        return numpy.linspace(0, 1, int(math.ceil(p['turns'] * p['n'])) + 1)
+
+    def curve(self, u, offset, p):
+        phi = 2 * math.pi * u
+        theta = p['turns'] * phi
+        ring = p['major'] + (p['minor'] + offset) * numpy.cos(theta)
+        return numpy.asarray(p['center'], dtype=float) + numpy.array(
+            [ring * numpy.cos(phi), ring * numpy.sin(phi), (p['minor'] + offset) * numpy.sin(theta)]).T
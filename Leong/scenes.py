@@ -0,0 +1,85 @@
+'''
+Fixed reference scenes, for benchmarks and accuracy checks.
+
+Each function returns a list of wire specs in the form taken by
+calculate() in B-calculate.py.  probes() gives a set of points
+to evaluate the field at for each scene.
+'''
+
+import math
+import numpy
+
+def single_wire():
+    '''The single short wire from B-calculate.py.'''
+    def a(t, o, at, fl):
+        if fl:
+            return (t, o, 0)
+        else:
+            if abs(t) <= 1:
+                return (t, o, 0)
+            else:
+                return None
+
+    return [[-2, 2, .025, a, [.25, .75], 9, lambda at: at >= 0]]
+
+def toroid(loops=8, toroid_r=1, r=1, start_toroid_r=5, ri=math.pi / 30,
+           offset=[-.25, -.5, -.75], nl=2, symmetric=False):
+    '''The shrinking toroid from B-calculate.py, loops copies of one loop.
+    With symmetric, one loop spec with a rotational symmetry.
+    '''
+    def loop(j):
+        c = math.cos(j * 2 * math.pi / loops)
+        s = math.sin(j * 2 * math.pi / loops)
+        def f(t, o, at):
+            R = toroid_r + (-start_toroid_r * (at - 1) if at <= 1 else 0) + (r + o) * math.cos(t)
+            return (c * R, s * R, (r + o) * math.sin(t))
+        return f
+
+    if symmetric:
+        return [[0, 2 * math.pi, ri, loop(0), offset, nl, lambda at: at >= 0, ('rotate', loops)]]
+    return [[0, 2 * math.pi, ri, loop(j), offset, nl, lambda at: at >= 0]
+            for j in range(loops)]
+
+def solenoid(num_of_points=10000, r=100, thetaadd=2 * math.pi / 50,
+             offset=[-50], nl=5):
+    '''Hong's solenoid: num_of_points segments, .5 apart along x.'''
+    def f(t, o):
+        i = t / thetaadd
+        return (.5 * (i - num_of_points / 2), (r + o) * math.cos(t), (r + o) * math.sin(t))
+
+    # Stop half a step early so float error can't add a point.
+    return [[0, (num_of_points + .5) * thetaadd, thetaadd, f, offset, nl, True]]
+
+def segment_count(wire):
+    '''Number of steps split() takes over a wire spec's range of t.'''
+    return int(round((wire[1] - wire[0]) / wire[2]))
+
+def resplit(wires, n):
+    '''The wire specs split into n steps each (or n[i] for wire i).
+    The step is a hair bigger than the span over the steps, so
+    float error can't add a point (or lose the last one).
+    '''
+    if not hasattr(n, '__len__'):
+        n = [n] * len(wires)
+    return [[wire[0], wire[1], (wire[1] - wire[0]) / (max(1, m) + 1e-4)] + list(wire[3:])
+            for wire, m in zip(wires, n)]
+
+def probes(name, n=400):
+    '''Points to evaluate the field of a scene at.'''
+    if name == 'solenoid':
+        # Hong's grid of 357 points
+        p = [(i, j, 0) for i in range(-53, 40, 15) for j in range(-250, 251, 10)]
+        return numpy.array(p, dtype=float)
+
+    rs = numpy.random.RandomState(0)
+    if name == 'toroid':
+        # At at=0 the loops sit 6 from the axis.
+        return rs.uniform(-8, 8, (n, 3)) * [1, 1, .25]
+    return rs.uniform(-2, 2, (n, 3)) * [1, 1, .5]
+
+# All the scenes, by name
+SCENES = {
+    'single': single_wire,
+    'toroid': toroid,
+    'solenoid': solenoid,
+    }
@@ -0,0 +1,230 @@
+'''
+Packs wires into contiguous segment arrays and evaluates
+the Biot-Savart sum over all of them at once using numpy.
+
+A wire is a list of (x, y, z) points, as returned by split()
+in B-calculate.py.  Segment p of a wire runs from point p
+to point p + 1.
+
+Two kernels are available:
+midpoint - each segment is a current element at its midpoint.
+           Only accurate when segments are short compared with
+           the distance to them.
+exact - the closed form field of a straight segment, so only the
+        wire's shape is approximated, not the field of each piece.
+
+The sum can be done in single precision (dtype numpy.float32), which
+halves its biggest temporary array, the offset of every point from
+every segment, and the time spent making and reducing it.  The
+geometry for it is kept relative to the middle of the wires, so the
+differences of nearby points don't lose their digits to big
+coordinates, and the sums over the segments are in double precision,
+where r ** -3 can't overflow and the two halves of the split cross
+product (which nearly cancel far from the wires) keep their digits.
+'''
+
+import multiprocessing
+import numpy
+
+# Number of (point, segment) pairs evaluated per block.
+# Keeps the temporary arrays small for many points, and
+# for wires of more than BLOCK segments.
+BLOCK = 1 << 18
+
+# Arrays that make up a Segments, see share()
+ARRAYS = ('start', 'end', 'mid', 'dl', 'dlxm', 'l2', 'dlxs', 'c')
+
+class Segments(object):
+    '''Wire segments packed into contiguous arrays.
+    start, end - segment end points, shape (n, 3)
+    mid - segment midpoints, shape (n, 3)
+    dl - segment vectors (end - start), shape (n, 3)
+    c - k * current of each segment, shape (n,)
+    kernel - 'midpoint' or 'exact'
+    dtype - precision of the sum, numpy.float64 or numpy.float32
+    origin - what the single precision geometry is relative to
+    work - the segments the sum is done with: these ones, or
+           single precision ones relative to origin
+    current can be one number or one per segment.
+    '''
+
+    def __init__(self, start, end, current=1, k=1, kernel='midpoint', dtype=numpy.float64):
+        if kernel not in ('midpoint', 'exact'):
+            raise ValueError('unknown kernel %r' % kernel)
+        self.kernel = kernel
+        self.start = numpy.asarray(start, dtype=float).reshape(-1, 3)
+        self.end = numpy.asarray(end, dtype=float).reshape(-1, 3)
+        self.mid = (self.start + self.end) / 2
+        self.dl = self.end - self.start
+        # dl x m, used to split the cross product in the sum
+        self.dlxm = numpy.cross(self.dl, self.mid)
+        # For the exact kernel: segment lengths squared, and dl x start
+        self.l2 = (self.dl ** 2).sum(axis=1)
+        self.dlxs = numpy.cross(self.dl, self.start)
+        # Constant in front of the sum for each segment, k * I
+        self.c = k * numpy.ones(len(self.dl)) * current
+
+        self.dtype = numpy.dtype(dtype)
+        self.origin = numpy.zeros(3)
+        self.work = self
+        if self.dtype != numpy.float64 and len(self.dl):
+            ends = numpy.concatenate([self.start, self.end])
+            self.origin = (ends.min(axis=0) + ends.max(axis=0)) / 2
+            self.work = Segments(self.start - self.origin, self.end - self.origin, kernel=kernel)
+            for name in ARRAYS:
+                if name != 'c':
+                    setattr(self.work, name, getattr(self.work, name).astype(self.dtype))
+            self.work.c = self.c
+            self.work.dtype = self.dtype
+
+    def __len__(self):
+        return len(self.dl)
+
+    def field(self, points):
+        '''Magnetic field at each of the points, shape (m, 3).'''
+        points = numpy.asarray(points, dtype=float).reshape(-1, 3)
+        b = numpy.zeros(points.shape)
+        if len(self) == 0:
+            return b
+        if self.work is not self:
+            points = points - self.origin
+
+        # Evaluate a block of points at a time, over at most
+        # BLOCK segments at a time.
+        step = max(1, BLOCK // len(self))
+        block = self.exact_block if self.kernel == 'exact' else self.field_block
+        for i in range(0, len(points), step):
+            if len(self) <= BLOCK:
+                b[i:i + step] = block(points[i:i + step])
+                continue
+            for j in range(0, len(self), BLOCK):
+                b[i:i + step] += block(points[i:i + step], slice(j, j + BLOCK))
+        return b
+
+    def field_block(self, points, s=slice(None)):
+        '''Midpoint Biot-Savart sum for a small block of points,
+        over the segments s.
+        '''
+        g = self.work
+        # Distance from the midpoint of each segment to each point
+        d = numpy.asarray(points, dtype=self.dtype)[:, None, :] - g.mid[None, s, :]
+        r = numpy.sqrt(numpy.einsum('ijk,ijk->ij', d, d))
+
+        # Check for divide by zero!
+        zero = r == 0
+        r[zero] = 1
+        c = self.c[s] * numpy.asarray(r, dtype=float) ** (-3)
+        c[zero] = 0
+
+        # Sum of c * dl x (p - m) over the segments, written as
+        # (sum c * dl) x p - sum c * (dl x m) so it's two products.
+        return numpy.cross(c.dot(g.dl[s]), points) - c.dot(g.dlxm[s])
+
+    def exact_block(self, points, s=slice(None)):
+        '''Exact straight segment Biot-Savart sum for a small block of points,
+        over the segments s.
+        With r1, r2 the distances from the segment's ends to the point
+        and L its length, each segment gives
+            2 (r1 + r2) / (r1 r2 ((r1 + r2)^2 - L^2)) dl x (p - start)
+        '''
+        g = self.work
+        p = numpy.asarray(points, dtype=self.dtype)
+        d = p[:, None, :] - g.start[None, s, :]
+        r1 = numpy.asarray(numpy.sqrt(numpy.einsum('ijk,ijk->ij', d, d)), dtype=float)
+        d = p[:, None, :] - g.end[None, s, :]
+        r2 = numpy.asarray(numpy.sqrt(numpy.einsum('ijk,ijk->ij', d, d)), dtype=float)
+
+        r12 = r1 + r2
+        den = r1 * r2 * (r12 * r12 - g.l2[s])
+
+        # Check for divide by zero! (the point is on the segment)
+        zero = den <= 0
+        den[zero] = 1
+        c = 2 * self.c[s] * r12 / den
+        c[zero] = 0
+
+        return numpy.cross(c.dot(g.dl[s]), points) - c.dot(g.dlxs[s])
+
+def pack(w, current=1, k=1, kernel='midpoint', dtype=numpy.float64):
+    '''Packs a list of wires into a Segments object.
+    current - the current of all the wires, or a list of one per wire
+    dtype - precision of the sum, see Segments
+    '''
+    if not hasattr(current, '__len__'):
+        current = [current] * len(w)
+    start = []
+    end = []
+    c = []
+    for wire, i in zip(w, current):
+        # Need at least two points for a segment
+        if len(wire) < 2:
+            continue
+        wire = numpy.asarray(wire, dtype=float)
+        start.append(wire[:-1])
+        end.append(wire[1:])
+        c.append(numpy.ones(len(wire) - 1) * i)
+
+    if not start:
+        return Segments(numpy.zeros((0, 3)), numpy.zeros((0, 3)), 1, k, kernel, dtype)
+    return Segments(numpy.concatenate(start), numpy.concatenate(end), numpy.concatenate(c), k, kernel, dtype)
+
+def parts(segs):
+    '''segs, and its single precision work segments if it has them.'''
+    return [segs] + ([segs.work] if segs.work is not segs else [])
+
+def share(segs, size=None):
+    '''Shared memory for the arrays of segments like segs, so worker
+    processes can all use the one copy instead of each getting it
+    pickled.  There's room for size segments (by default len(segs)),
+    so it can be filled again with other segments, see fits() and fill().
+    Returns what fill() and attach() take, to hand to the workers
+    when they start.
+    '''
+    size = max(size or 0, len(segs), 1)
+    shared = []
+    for g in parts(segs):
+        arrays = {}
+        for name in ARRAYS:
+            a = getattr(g, name)
+            rest = a.shape[1:]
+            arrays[name] = (multiprocessing.RawArray(a.dtype.char, size * int(numpy.prod(rest))), rest)
+        shared.append(arrays)
+    return size, shared
+
+def fits(shared, segs):
+    '''Whether segs fit in the shared memory from share().'''
+    size, arrays = shared
+    return (len(segs) <= size and len(arrays) == len(parts(segs)) and
+            all(numpy.ctypeslib.as_array(a[name][0]).dtype == getattr(g, name).dtype
+                for g, a in zip(parts(segs), arrays) for name in ARRAYS))
+
+def fill(shared, segs):
+    '''Copies segs into the shared memory from share() (see fits()).
+    Returns the layout attach() needs to find them there.
+    '''
+    size, arrays = shared
+    for g, a in zip(parts(segs), arrays):
+        for name in ARRAYS:
+            x = getattr(g, name)
+            numpy.ctypeslib.as_array(a[name][0])[:x.size] = x.reshape(-1)
+    return segs.kernel, segs.dtype, segs.origin, len(segs)
+
+def attach(shared, layout):
+    '''Segments using the shared memory from share(), as filled by
+    fill() with the given layout, without copying it.
+    '''
+    kernel, dtype, origin, n = layout
+    size, arrays = shared
+    out = []
+    for a in arrays:
+        segs = Segments.__new__(Segments)
+        segs.kernel = kernel
+        segs.dtype = numpy.dtype(dtype)
+        segs.origin = origin
+        for name, (raw, rest) in a.items():
+            m = n * int(numpy.prod(rest))
+            setattr(segs, name, numpy.ctypeslib.as_array(raw)[:m].reshape((n,) + rest))
+        segs.work = segs
+        out.append(segs)
+    out[0].work = out[-1]
+    return out[0]